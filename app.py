@@ -3,20 +3,33 @@ from flask_wtf import FlaskForm
 from flask_bootstrap import Bootstrap
 from wtforms import StringField, SubmitField, TextAreaField, HiddenField, IntegerField, SelectField, BooleanField, SelectMultipleField
 from wtforms.validators import DataRequired, NumberRange
-from quart import Quart, render_template, send_file, safe_join, url_for, redirect, flash, request, abort
+from quart import Quart, render_template, send_file, safe_join, url_for, redirect, flash, request, abort, make_response, jsonify, session, Response
 
 import asyncio
 from pathlib import Path
 import os
-from hashlib import shake_128
+import tempfile
+from hashlib import shake_128, sha1
 import random
+import re
 
 from heavenly.host import Host
 from heavenly.notify import DiscordNotifier
-from heavenly.config.app import APP_NAME, SERVER_ADDRESS, MOTD, HOST_ROOT_PATH, HOST_PORT_RANGE, SECRET_KEY, SRC_REPO_URL
-from heavenly.maps import MAP_THUMBNAIL_DIR
+from heavenly.events import format_event
+from heavenly.cache import LRUCache, ByteLRUCache
+from heavenly.cluster import Coordinator, ClusterError
+from heavenly.config.cluster import CLUSTER_WORKERS
+from heavenly.config.state import STATE_DB_PATH
+from heavenly.config.scores import SCORE_CHART_POINTS
+from heavenly.profiling import profiler, timed
+from heavenly.state import StateStore, StoreView
+from heavenly.config.app import APP_NAME, SERVER_ADDRESS, MOTD, HOST_ROOT_PATH, HOST_PORT_RANGE, SECRET_KEY, SRC_REPO_URL, RENDER_CACHE_SIZE, MAP_PAGE_CACHE_SIZE, IMAGE_CACHE_BYTES, IMAGE_MAX_AGE, HOST_MODE, MAX_TURN_FILE_BYTES
+from heavenly.maps import MAP_THUMBNAIL_DIR, MapQuery
+from heavenly.tiles import TILE_VARIANTS
 from heavenly.mods import MOD_ICON_DIR
 
+render_template = timed("render_template")(render_template)
+
 bootstrap = Bootstrap()
 app = Quart(__name__)
 bootstrap.init_app(app)
@@ -33,6 +46,14 @@ app.config.update({
 
 app.jinja_env.globals.update(app.config)
 
+render_cache = LRUCache(maxsize = RENDER_CACHE_SIZE)
+# map search pages get their own cache, so arbitrary filters can't push the
+# index and game pages out of render_cache
+map_page_cache = LRUCache(maxsize = MAP_PAGE_CACHE_SIZE)
+image_cache = ByteLRUCache(
+  maxbytes = IMAGE_CACHE_BYTES, sizeof = lambda entry: len(entry[1])
+)
+
 @app.errorhandler(404)
 async def page_not_found(error):
   return "404 - page not found"
@@ -40,17 +61,20 @@ async def page_not_found(error):
 @app.route("/")
 async def index():
   host = app.config.get('host_instance')
-  game_info = []
-  for game in host.games:
-    game_info.append(dict(
-      name = game.name, 
-      state = game.state, 
-      turn = game.turn, 
-      finished = game.finished,
-      port = game.settings["port"]
-    )
-  )
-  return await render_template("home.html", game_info = game_info)
+  coordinator = app.config.get("coordinator")
+  version = (host.epoch, host.version, coordinator.version if coordinator else None)
+
+  def context():
+    game_info = host.game_summaries()
+    if coordinator: game_info.extend(coordinator.game_summaries())
+    return dict(game_info = game_info)
+
+  return await cached_render("index", version, "home.html", context)
+
+@app.route("/events")
+async def index_events():
+  host = app.config.get("host_instance")
+  return await event_stream(host.events)
 
 @app.route("/new-game", methods = ["GET", "POST"])
 async def new_game():
@@ -94,13 +118,30 @@ async def new_game():
                 if form.notifier.data else None
     )
     name = form.name.data.replace(" ", "_")
-    if host.find_game_by_name(name):
+    coordinator = app.config.get("coordinator")
+    if (host.find_game_by_name(name) or name in host.archived_games
+        or (coordinator and coordinator.find_worker_for_game(name))):
       await flash("A game by that name already exists.")
       return redirect(url_for("index")) 
-    new_game = host.create_new_game(name, notifiers, **config)
-    asyncio.create_task(new_game.run_until_cancelled())
-    port = config["port"]
-    address = f"{SERVER_ADDRESS}:{port}"
+    if coordinator:
+      try:
+        worker, summary = await coordinator.place_game(name, config, notifiers or ())
+      except (OSError, ConnectionError, ClusterError) as error:
+        await flash(f"The game could not be placed: {error}")
+        return redirect(url_for("index"))
+      address = f"{worker.address}:{summary['port']}"
+    elif host.readonly:
+      host.request_new_game(name, notifiers, config)
+      await flash(
+        "The Wheel has turned once again. "
+        "Your game will be listed here soon."
+      )
+      return redirect(url_for("index"))
+    else:
+      new_game = host.create_new_game(name, notifiers, **config)
+      new_game.start()
+      port = config["port"]
+      address = f"{SERVER_ADDRESS}:{port}"
     await flash(
       "The Wheel has turned once again. " 
       f"Your game will be available at {address} soon."
@@ -111,62 +152,389 @@ async def new_game():
 
 @app.route("/games/<name>")
 async def game_status(name):
-  host = app.config.get('host_instance')
-  game_instance = host.find_game_by_name(name)
-  if not game_instance: abort(404)
+  host = app.config.get("host_instance")
+  game_instance = await find_game_view(name)
 
-  players = []
-  for player in game_instance.players:
-    if player["eliminated"]: turn = "eliminated"
-    else:
-      turn = "unknown"
-      connected = False
-      for _tuple in game_instance.who_played:
-        if _tuple[0] == player["shortname"]:
-          turn = _tuple[1]
-          connected = _tuple[2]
-    players.append((player["name"], turn, connected))
+  def context():
+    return dict(
+      game = game_instance,
+      players = game_instance.player_status(),
+      time = Dom5Time(game_instance.turn)
+    )
+
+  kind = "worker-game" if getattr(game_instance, "worker", None) else "game"
+  return await cached_render(
+    (kind, game_instance.name), (host.epoch, game_instance.version), "game.html", context
+  )
+
+@app.route("/games/<name>/events")
+async def game_events(name):
+  game_instance = await find_game_view(name)
+  initial = format_event("status", game_instance.status())
+  return await event_stream(game_instance.events, initial)
+
+@app.route("/api/v1/games")
+async def api_games():
+  host = app.config.get("host_instance")
+  coordinator = app.config.get("coordinator")
+  # both counters only grow, so their sum moves whenever either list does
+  version = host.version + (coordinator.version if coordinator else 0)
+  etag = f"games-{host.epoch}-{version}"
+
+  def build():
+    games = host.game_summaries()
+    if coordinator: games.extend(coordinator.game_summaries())
+    return dict(version = version, games = games)
 
-  time = Dom5Time(game_instance.turn)
+  return await conditional_json(etag, build)
 
+@app.route("/api/v1/games/<name>")
+async def api_game_status(name):
+  host = app.config.get("host_instance")
+  game_instance = await find_game_view(name)
+  etag = f"game-{game_instance.name}-{host.epoch}-{game_instance.version}"
+  return await conditional_json(etag, game_instance.status)
+
+@app.route("/api/v1/games/<name>/scores")
+async def api_game_scores(name):
+  host = app.config.get("host_instance")
+  metric = request.args.get("metric")
+  points = min(request.args.get("points", SCORE_CHART_POINTS, type = int), SCORE_CHART_POINTS)
+  points = max(points, 2)
+  game_instance = await find_game_view(name)
+  if getattr(game_instance, "worker", None):
+    try:
+      remote = await app.config["coordinator"].game_scores(name, metric, points)
+    except (OSError, ConnectionError, ClusterError):
+      abort(503)
+    if not remote or remote["scores"] is None: abort(404)
+    etag = f"scores-{name}-{remote['worker']}-{remote['version']}-{metric}-{points}"
+    return await conditional_json(etag, lambda: remote["scores"])
+  etag = f"scores-{game_instance.name}-{host.scores.version(name)}-{metric}-{points}"
+  def build():
+    scores = host.scores.sample(name, metric, points)
+    if scores is None: abort(404)
+    return scores
+  return await conditional_json(etag, build)
+
+@app.route("/games/<name>/<code>")
+async def game_admin(name, code):
+  game_instance = find_game_for_admin(name, code)
+  turn_files = sorted(
+    file_path.name for file_path in game_instance.path.iterdir()
+    if TURN_FILE_REGEX.match(file_path.name)
+  )
   return await render_template(
-    "game.html", 
-    game = game_instance, 
-    players = players, 
-    time = time
+    "game_admin.html",
+    game = game_instance,
+    code = code,
+    snapshot_turns = game_instance.snapshot_turns(),
+    turn_files = [(filename, nation_passcode(game_instance, filename.rpartition(".")[0]))
+                  for filename in turn_files]
   )
 
-@app.route("/games/<name>/<passcode>")
-async def game_admin(name, passcode):
+@app.route("/games/<name>/<code>/rollback", methods = ["POST"])
+async def game_rollback(name, code):
+  game_instance = find_game_for_admin(name, code)
+  form = await request.form
+  turn = form.get("turn", type = int)
+  if turn not in game_instance.snapshot_turns(): abort(404)
+  await game_instance.rollback(turn)
+  await flash(f"{game_instance.name} has been rolled back to turn {turn}.")
+  return redirect(url_for("game_admin", name = name, code = code))
+
+@app.route("/games/<name>/<code>/archive", methods = ["POST"])
+async def game_archive(name, code):
+  game_instance = find_game_for_admin(name, code)
   host = app.config.get("host_instance")
-  game_instance = host.find_game_by_name(name)
-  if not game_instance: abort(404)
-  if passcode == passcode(game_instance):
-    return "Access granted!!"
+  if not game_instance.finished:
+    await flash("Only finished games can be archived.")
+  elif await host.archive_game(game_instance):
+    await flash(f"{game_instance.name} has been archived.")
+    return redirect(url_for("archived_game", name = name))
   else:
+    await flash(f"{game_instance.name} could not be archived; its save data was kept.")
+  return redirect(url_for("game_admin", name = name, code = code))
+
+@app.route("/games/<name>/<code>/files/<filename>")
+async def download_turn_file(name, code, filename):
+  game_instance = find_game_for_file(name, code, filename)
+  path = game_instance.path / filename
+  if not path.is_file(): abort(404)
+
+  stat = path.stat()
+  etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+  headers = {"ETag": f'"{etag}"', "Accept-Ranges": "bytes", "Cache-Control": "no-cache"}
+  if request.if_none_match.contains(etag):
+    return "", 304, headers
+
+  start, end = 0, stat.st_size - 1
+  status = 200
+  if_range = request.headers.get("If-Range")
+  byte_range = parse_byte_range(request.headers.get("Range"), stat.st_size)
+  if byte_range and (not if_range or if_range.strip('"') == etag):
+    if byte_range == "unsatisfiable":
+      headers["Content-Range"] = f"bytes */{stat.st_size}"
+      return "", 416, headers
+    start, end = byte_range
+    status = 206
+    headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+
+  headers.update({
+    "Content-Length": str(end - start + 1),
+    "Content-Disposition": f"attachment; filename={filename}"
+  })
+  return Response(
+    read_file_chunks(path, start, end), status = status,
+    mimetype = "application/octet-stream", headers = headers
+  )
+
+@app.route("/games/<name>/<code>/files/<filename>", methods = ["PUT"])
+async def upload_turn_file(name, code, filename):
+  game_instance = find_game_for_file(name, code, filename)
+  if not filename.endswith(".2h"): abort(403)
+  loop = asyncio.get_running_loop()
+  # a temp file per upload: two uploads of the same nation's orders must
+  # not write into one file
+  fd, tmp_path = tempfile.mkstemp(
+    dir = game_instance.path, prefix = f".{filename}.", suffix = ".upload"
+  )
+  size = 0
+  try:
+    with os.fdopen(fd, "wb") as file:
+      async for chunk in request.body:
+        size += len(chunk)
+        if size > MAX_TURN_FILE_BYTES: abort(413)
+        await loop.run_in_executor(None, file.write, chunk)
+    # dom5 only ever sees a complete file
+    os.replace(tmp_path, game_instance.path / filename)
+  finally:
+    if os.path.exists(tmp_path): os.unlink(tmp_path)
+  return jsonify(name = filename, size = size), 201
+
+@app.route("/games/<name>/<code>/command", methods = ["POST"])
+async def game_command(name, code):
+  game_instance = find_game_for_admin(name, code)
+  form = await request.form
+  command = clean_command(form.get("command"))
+  game_instance.queue_command(command)
+  await flash(f"Queued '{command}' for {game_instance.name}.")
+  return redirect(url_for("game_admin", name = name, code = code))
+
+@app.route("/admin/<code>")
+async def host_admin(code):
+  host = app.config.get("host_instance")
+  if host.readonly or code != admin_passcode(): abort(404)
+  games = [game for game in host.games if not game.finished]
+  return await render_template(
+    "admin.html", games = games, code = code, profiling = profiler.enabled,
+    archived_games = sorted(host.archived_games), command_log = host.command_log,
+    finished_games = [game.name for game in host.games if game.finished]
+  )
+
+@app.route("/admin/<code>/rescan", methods = ["POST"])
+async def rescan_library(code):
+  host = app.config.get("host_instance")
+  if host.readonly or code != admin_passcode(): abort(404)
+  loop = asyncio.get_running_loop()
+  await loop.run_in_executor(None, host.scan_library)
+  image_cache.clear()
+  app.config["map_choices"][:] = [(_map.filename, _map.title) for _map in host.maps]
+  app.config["mod_choices"][:] = [(mod.filename, mod.title) for mod in host.mods]
+  await flash(f"Found {len(host.maps)} maps and {len(host.mods)} mods.")
+  return redirect(url_for("host_admin", code = code))
+
+@app.route("/admin/<code>/archive", methods = ["POST"])
+async def archive_finished(code):
+  host = app.config.get("host_instance")
+  if host.readonly or code != admin_passcode(): abort(404)
+  archived = await host.archive_finished()
+  await flash(f"Archived {len(archived)} finished game(s).")
+  return redirect(url_for("host_admin", code = code))
+
+@app.route("/admin/<code>/unarchive", methods = ["POST"])
+async def unarchive_game(code):
+  host = app.config.get("host_instance")
+  if host.readonly or code != admin_passcode(): abort(404)
+  form = await request.form
+  name = form.get("name")
+  if name not in host.archived_games or host.find_game_by_name(name): abort(404)
+  if await host.unarchive_game(name):
+    await flash(f"{name} has been restored from the archive.")
+  else:
+    await flash(f"{name} could not be restored: its save data is missing.")
+  return redirect(url_for("host_admin", code = code))
+
+@app.route("/admin/<code>/commands", methods = ["POST"])
+async def bulk_command(code):
+  host = app.config.get("host_instance")
+  if host.readonly or code != admin_passcode(): abort(404)
+  form = await request.form
+  command = clean_command(form.get("command"))
+  names = set(form.getlist("games"))
+  games = [game for game in host.games if game.name in names and not game.finished]
+  # dom5 only reads domcmd between its own checks, so confirmations are
+  # collected in the background into host.command_log, which the admin
+  # page lists, rather than holding the request open
+  asyncio.create_task(host.bulk_command(games, command))
+  await flash(
+    f"Queued '{command}' for {len(games)} game{'s' if len(games) != 1 else ''}; "
+    "confirmations are listed under recent commands."
+  )
+  return redirect(url_for("host_admin", code = code))
+
+@app.route("/admin/<code>/profile")
+async def profile_report(code):
+  if not profiler.enabled or code != admin_passcode(): abort(404)
+  return jsonify(profiler.report())
+
+@app.route("/admin/<code>/profile.folded")
+async def profile_stacks(code):
+  if not profiler.enabled or code != admin_passcode(): abort(404)
+  return Response(profiler.folded(), mimetype = "text/plain")
+
+@app.route("/cluster/<code>")
+async def cluster_admin(code):
+  coordinator = app.config.get("coordinator")
+  if not coordinator or code != admin_passcode(): abort(404)
+  return await render_template(
+    "cluster.html", workers = coordinator.workers, code = code
+  )
+
+@app.route("/cluster/<code>/drain", methods = ["POST"])
+async def cluster_drain(code):
+  coordinator = app.config.get("coordinator")
+  if not coordinator or code != admin_passcode(): abort(404)
+  form = await request.form
+  try:
+    await coordinator.drain(form.get("worker"))
+    await flash(f"{form.get('worker')} has been drained.")
+  except (OSError, ConnectionError, ClusterError) as error:
+    await flash(f"Draining failed: {error}")
+  return redirect(url_for("cluster_admin", code = code))
+
+@app.route("/cluster/<code>/migrate", methods = ["POST"])
+async def cluster_migrate(code):
+  coordinator = app.config.get("coordinator")
+  if not coordinator or code != admin_passcode(): abort(404)
+  form = await request.form
+  target = coordinator.find_worker(form.get("target")) if form.get("target") else None
+  try:
+    worker, _ = await coordinator.migrate(form.get("name"), target)
+    await flash(f"{form.get('name')} has been moved to {worker.id}.")
+  except (OSError, ConnectionError, ClusterError) as error:
+    await flash(f"Migration failed: {error}")
+  return redirect(url_for("cluster_admin", code = code))
+
+@app.route("/archive/<name>")
+async def archived_game(name):
+  host = app.config.get("host_instance")
+  game = host.archived_games.get(name)
+  if not game: abort(404)
+  loop = asyncio.get_running_loop()
+  files = await loop.run_in_executor(None, game.files)
+  return await render_template("archive.html", game = game, files = files)
+
+@app.route("/archive/<name>/<path:filename>")
+async def archived_game_file(name, filename):
+  host = app.config.get("host_instance")
+  game = host.archived_games.get(name)
+  if not game: abort(404)
+  loop = asyncio.get_running_loop()
+  try:
+    body = await loop.run_in_executor(None, game.read, filename)
+  except KeyError:
     abort(404)
+  return Response(body, mimetype = "application/octet-stream", headers = {
+    "Content-Disposition": f"attachment; filename={Path(filename).name}"
+  })
 
 @app.route("/maps")
 async def map_directory():
   host = app.config.get("host_instance")
-  maps = host.maps
-  return await render_template("maps.html", maps = maps)
+  query = map_query_from_args()
+
+  def context():
+    maps, total = host.map_index.search(query)
+    pages = max(1, -(-total // query.per_page))
+    # the page is cached under the normalised query, so its links are built
+    # from that too and never from whichever query string rendered it first
+    return dict(
+      maps = maps, total = total, query = query, pages = pages,
+      query_args = map_query_args(query)
+    )
+
+  return await cached_render(
+    query.key(), host.library_version, "maps.html", context, cache = map_page_cache
+  )
+
+@app.route("/api/v1/maps")
+async def api_maps():
+  host = app.config.get("host_instance")
+  query = map_query_from_args()
+  query_hash = shake_128(repr(query.key()).encode("utf8")).hexdigest(8)
+  etag = f"maps-{host.epoch}-{host.library_version}-{query_hash}"
+
+  def build():
+    maps, total = host.map_index.search(query)
+    return dict(
+      total = total,
+      page = query.page,
+      per_page = query.per_page,
+      maps = [dict(
+        filename = _map.filename,
+        title = _map.title,
+        provinces = _map.provinces,
+        underwater = _map.underwater,
+        wraparound = _map.wraparound,
+        average_degree = _map.average_degree,
+        thumbnail = url_for("get_map_thumb", filename = _map.thumbnail)
+      ) for _map in maps]
+    )
+
+  return await conditional_json(etag, build)
+
+@app.route("/maps/<filename>")
+async def map_viewer(filename):
+  host = app.config.get("host_instance")
+  _map = host.find_map_by_filename(filename)
+  if not _map: abort(404)
+  return await render_template("map_viewer.html", map = _map)
+
+@app.route("/maps/<filename>/tiles/<variant>.json")
+async def map_tile_info(filename, variant):
+  pyramid = await find_tile_pyramid(filename, variant)
+  return jsonify(pyramid.as_dict())
+
+@app.route("/maps/<filename>/tiles/<variant>/<int:level>/<int:col>_<int:row>.jpg")
+async def map_tile(filename, variant, level, col, row):
+  pyramid = await find_tile_pyramid(filename, variant)
+  if not pyramid.has_tile(level, col, row): abort(404)
+  host = app.config.get("host_instance")
+  loop = asyncio.get_running_loop()
+  body = await loop.run_in_executor(
+    None, host.tile_cache.get_tile, pyramid, level, col, row
+  )
+  return Response(
+    body, mimetype = "image/jpeg",
+    headers = {"Cache-Control": f"public, max-age={IMAGE_MAX_AGE}"}
+  )
 
 @app.route("/mods")
 async def mod_directory():
   host = app.config.get("host_instance")
-  mods = host.mods
-  return await render_template("mods.html", mods = mods)
+  return await cached_render(
+    "mods", host.library_version, "mods.html",
+    lambda: dict(mods = host.mods)
+  )
 
 @app.route("/thumb/<filename>")
 async def get_map_thumb(filename):
-  path = safe_join(MAP_THUMBNAIL_DIR, filename)
-  return await send_file(path)
+  return await serve_image(MAP_THUMBNAIL_DIR, filename)
 
 @app.route("/icon/<filename>")
 async def get_mod_icon(filename):
-  path = safe_join(MOD_ICON_DIR, filename)
-  return await send_file(path)
+  return await serve_image(MOD_ICON_DIR, filename)
 
 @app.route("/rand")
 async def random_nation():
@@ -183,18 +551,33 @@ async def random_nation():
 
 @app.before_serving
 async def startup():
-  host = Host(HOST_ROOT_PATH, port_range = HOST_PORT_RANGE)
-  host.restore_games()
-  asyncio.create_task(host.startup())
+  if HOST_MODE == "web":
+    # games are supervised elsewhere; this worker only mirrors their state
+    library = Host(HOST_ROOT_PATH, port_range = HOST_PORT_RANGE, mirror = True)
+    host = StoreView(StateStore(STATE_DB_PATH), library)
+    host.refresh()
+    asyncio.create_task(host.run())
+    # every web worker profiles its own loop, so each needs its own dump
+    profiler.start(HOST_ROOT_PATH / f"profile-web-{os.getpid()}.folded")
+  else:
+    host = Host(HOST_ROOT_PATH, port_range = HOST_PORT_RANGE)
+    host.restore_games()
+    asyncio.create_task(host.startup())
   map_choices = app.config.get("map_choices")
   map_choices.extend([(_map.filename, _map.title) for _map in host.maps])
   mod_choices = app.config.get("mod_choices")
   mod_choices.extend([(mod.filename, mod.title) for mod in host.mods])
   app.config.update(host_instance = host, map_choices = map_choices)
+  if CLUSTER_WORKERS:
+    coordinator = Coordinator(CLUSTER_WORKERS, events = host.events)
+    asyncio.create_task(coordinator.run())
+    app.config.update(coordinator = coordinator)
 
 @app.after_serving
 async def shutdown():
   app.config["host_instance"].shutdown()
+  # a web worker's StoreView doesn't stop the profiler; stop() is idempotent
+  profiler.stop()
 
 class NewGameForm(FlaskForm):
   map_choices = app.config.get("map_choices")
@@ -325,8 +708,171 @@ class Dom5Time:
     return f"{self.season[0]} {self.season[1]} in the year {self.year} of the Ascension Wars (turn {self.turn})"
 
 
+async def cached_render(key, version, template, context, cache = render_cache):
+  # pages with pending flash messages are personal, so never cache those
+  if session.get("_flashes"):
+    return await render_template(template, **context())
+  cached = cache.get(key)
+  if cached and cached[0] == version:
+    return cached[1]
+  rendered = await render_template(template, **context())
+  cache.put(key, (version, rendered))
+  return rendered
+
+TURN_FILE_REGEX = re.compile(r"^[A-Za-z0-9_]+\.(2h|trn)$")
+
+async def find_game_view(name):
+  # games on cluster workers are read through the coordinator
+  host = app.config.get("host_instance")
+  game_instance = host.find_game_by_name(name)
+  coordinator = app.config.get("coordinator")
+  if not game_instance and coordinator:
+    try:
+      game_instance = await coordinator.game_view(name)
+    except (OSError, ConnectionError, ClusterError):
+      abort(503)
+  if not game_instance: abort(404)
+  return game_instance
+
+def find_game_for_file(name, code, filename):
+  host = app.config.get("host_instance")
+  game_instance = host.find_game_by_name(name)
+  if host.readonly or not game_instance or not TURN_FILE_REGEX.match(filename):
+    abort(404)
+  # the game passcode opens every file, a nation passcode only its own
+  stem = filename.rpartition(".")[0]
+  if code not in (passcode(game_instance), nation_passcode(game_instance, stem)):
+    abort(404)
+  return game_instance
+
+def parse_byte_range(header, size):
+  match = re.match(r"^bytes=(\d*)-(\d*)$", header or "")
+  if not match or match.groups() == ("", ""): return None
+  first, last = match.groups()
+  if first:
+    start, end = int(first), min(int(last), size - 1) if last else size - 1
+  else:
+    start, end = max(size - int(last), 0), size - 1
+  if start > end or start >= size: return "unsatisfiable"
+  return start, end
+
+async def read_file_chunks(path, start, end, chunk_size = 256 * 1024):
+  loop = asyncio.get_running_loop()
+  with open(path, "rb") as file:
+    file.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+      chunk = await loop.run_in_executor(None, file.read, min(chunk_size, remaining))
+      if not chunk: break
+      remaining -= len(chunk)
+      yield chunk
+
+def clean_command(command):
+  command = (command or "").strip()
+  if not command or "\n" in command or "\r" in command: abort(400)
+  return command
+
+def find_game_for_admin(name, code):
+  host = app.config.get("host_instance")
+  game_instance = host.find_game_by_name(name)
+  if host.readonly or not game_instance or code != passcode(game_instance):
+    abort(404)
+  return game_instance
+
+def map_query_from_args():
+  args = request.args
+  return MapQuery(
+    min_provinces = args.get("min_provinces", type = int),
+    max_provinces = args.get("max_provinces", type = int),
+    wraparound = args.get("wraparound") or None,
+    max_underwater = args.get("max_underwater", type = float),
+    text = args.get("q") or None,
+    page = args.get("page", default = 1, type = int),
+    per_page = min(args.get("per_page", default = 25, type = int), 100)
+  )
+
+def map_query_args(query):
+  args = dict(
+    q = query.text,
+    min_provinces = query.min_provinces,
+    max_provinces = query.max_provinces,
+    wraparound = query.wraparound,
+    max_underwater = query.max_underwater,
+    per_page = query.per_page
+  )
+  return {name: value for name, value in args.items() if value is not None}
+
+async def find_tile_pyramid(filename, variant):
+  host = app.config.get("host_instance")
+  _map = host.find_map_by_filename(filename)
+  if not _map or variant not in TILE_VARIANTS: abort(404)
+  pyramid = host.tile_cache.cached_pyramid(_map, variant)
+  if not pyramid:
+    loop = asyncio.get_running_loop()
+    pyramid = await loop.run_in_executor(None, host.tile_cache.pyramid, _map, variant)
+  if not pyramid: abort(404)
+  return pyramid
+
+def load_image(path):
+  with open(path, "rb") as file:
+    body = file.read()
+  return sha1(body).hexdigest(), body
+
+async def serve_image(directory, filename):
+  path = Path(safe_join(directory, filename))
+  mimetype = "image/jpeg"
+  webp_path = path.with_name(path.name + ".webp")
+  if "image/webp" in request.headers.get("Accept", "") and webp_path.exists():
+    path, mimetype = webp_path, "image/webp"
+  try:
+    # keyed by mtime too, so a thumbnail rewritten by a library rescan (here
+    # or in the supervisor) is never served from a stale entry
+    key = (str(path), path.stat().st_mtime_ns)
+  except FileNotFoundError:
+    abort(404)
+  cached = image_cache.get(key)
+  if cached is None:
+    loop = asyncio.get_running_loop()
+    cached = await loop.run_in_executor(None, load_image, path)
+    image_cache.put(key, cached)
+  etag, body = cached
+
+  headers = {
+    "ETag": f'"{etag}"',
+    "Cache-Control": f"public, max-age={IMAGE_MAX_AGE}",
+    "Vary": "Accept"
+  }
+  if request.if_none_match.contains(etag):
+    return "", 304, headers
+  return Response(body, mimetype = mimetype, headers = headers)
+
+async def conditional_json(etag, build):
+  # the etag is checked before build() runs, so a 304 costs no rendering
+  headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+  if request.if_none_match.contains(etag):
+    return "", 304, headers
+  response = jsonify(build())
+  response.headers.update(headers)
+  return response
+
+async def event_stream(broadcaster, initial = None):
+  response = await make_response(broadcaster.stream(initial))
+  response.timeout = None
+  response.headers.update({
+    "Content-Type": "text/event-stream",
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+  })
+  return response
+
 def passcode(game):
   return shake_128((SECRET_KEY + game.name).encode("utf8")).hexdigest(8)
 
+def nation_passcode(game, stem):
+  return shake_128((SECRET_KEY + game.name + "/" + stem).encode("utf8")).hexdigest(8)
+
+def admin_passcode():
+  return shake_128((SECRET_KEY + "/admin").encode("utf8")).hexdigest(8)
+
 
 
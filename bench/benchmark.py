@@ -0,0 +1,114 @@
+# Benchmarks the host against the fake dom5 server in bench/fake_dom5:
+#
+#   python bench/benchmark.py --games 10 100 1000 --duration 30
+#
+# Every simulated game is a separate fake dom5 process, so 1000 games need a
+# machine that can hold 1000 small python processes.
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+BENCH_PATH = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_PATH.parent))
+os.environ["DOM5_PATH"] = str(BENCH_PATH / "fake_dom5")
+FAKE_DEFAULTS = dict(
+  FAKE_DOM5_SETUP_SECONDS = "2",
+  FAKE_DOM5_UPDATE_INTERVAL = "1",
+  FAKE_DOM5_TURN_SECONDS = "10",
+  FAKE_DOM5_TURN_GEN_SECONDS = "0.5",
+)
+for key, value in FAKE_DEFAULTS.items(): os.environ.setdefault(key, value)
+
+from heavenly.host import Host
+from heavenly.dom5 import STATUS_ACTIVE, STATUS_TURN_GEN
+
+def rss_bytes():
+  with open("/proc/self/status", "r") as file:
+    for line in file:
+      if line.startswith("VmRSS:"): return int(line.split()[1]) * 1024
+  return 0
+
+def track_turn_latency(game, latencies):
+  @game.when_status_change("state")
+  def record(prev, new):
+    if new == STATUS_TURN_GEN:
+      stamp = game.path / "fake_turngen_time"
+      if stamp.exists():
+        latencies.append(time.time() - float(stamp.read_text()))
+
+async def measure_http(host, duration):
+  from app import app
+  app.config.update(host_instance = host)
+  client = app.test_client()
+  names = [game.name for game in host.games]
+  urls = ["/", "/api/v1/games"]
+  urls += [f"/games/{name}" for name in names[:20]]
+  urls += [f"/api/v1/games/{name}" for name in names[:20]]
+  count, deadline = 0, time.monotonic() + duration
+  while time.monotonic() < deadline:
+    response = await client.get(urls[count % len(urls)])
+    assert response.status_code == 200, (urls[count % len(urls)], response.status_code)
+    count += 1
+  return count / duration
+
+async def run_benchmark(count, duration, http_duration):
+  root = Path(tempfile.mkdtemp(prefix = f"heavenly-bench-{count}-"))
+  host = Host(root, port_range = (20000, 20000 + count + 16))
+  host.restore_games()
+  await host.startup()
+
+  baseline = rss_bytes()
+  latencies = []
+  started = time.monotonic()
+  for n in range(count):
+    game = host.create_new_game(f"bench{n}", port = host.get_free_port())
+    track_turn_latency(game, latencies)
+    game.start()
+  created = time.monotonic() - started
+
+  while not all(game.state == STATUS_ACTIVE for game in host.games):
+    await asyncio.sleep(0.1)
+    if time.monotonic() - started > 120 + count: break
+  startup = time.monotonic() - started
+
+  await asyncio.sleep(duration)
+  memory = (rss_bytes() - baseline) / count
+  throughput = await measure_http(host, http_duration)
+
+  await asyncio.gather(*(game.stop() for game in host.games))
+  host.shutdown()
+  return dict(
+    games = count,
+    create = created,
+    startup = startup,
+    latency_mean = statistics.mean(latencies) if latencies else float("nan"),
+    latency_max = max(latencies) if latencies else float("nan"),
+    turns = len(latencies),
+    memory_per_game = memory,
+    http_rps = throughput,
+  )
+
+def main():
+  parser = argparse.ArgumentParser(description = "Benchmark the host against fake dom5 servers.")
+  parser.add_argument("--games", type = int, nargs = "+", default = [10, 100, 1000])
+  parser.add_argument("--duration", type = float, default = 30,
+                      help = "seconds to let games run before measuring")
+  parser.add_argument("--http-duration", type = float, default = 5)
+  args = parser.parse_args()
+
+  print(f"{'games':>6} {'create s':>9} {'startup s':>10} {'turns':>6} "
+        f"{'latency ms':>11} {'max ms':>8} {'KiB/game':>9} {'req/s':>8}")
+  for count in args.games:
+    result = asyncio.run(run_benchmark(count, args.duration, args.http_duration))
+    print(f"{result['games']:>6} {result['create']:>9.2f} {result['startup']:>10.2f} "
+          f"{result['turns']:>6} {1000 * result['latency_mean']:>11.1f} "
+          f"{1000 * result['latency_max']:>8.1f} {result['memory_per_game'] / 1024:>9.1f} "
+          f"{result['http_rps']:>8.1f}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,107 @@
+import os
+import json
+import shutil
+import zipfile
+from pathlib import Path
+
+class ArchivedGame:
+
+  def __init__(self, name, *, archive_path, turn = 0, settings = None, players = None):
+    self.name = name
+    self.archive_path = archive_path
+    self.turn = turn
+    self.settings = settings or {}
+    self.players = players or []
+    self.finished = True
+    self.state = "archived"
+
+  def summary(self):
+    return dict(
+      name = self.name,
+      state = self.state,
+      turn = self.turn,
+      finished = self.finished,
+      port = self.settings.get("port"),
+      archived = True
+    )
+
+  def files(self):
+    with zipfile.ZipFile(self.archive_path) as archive:
+      return archive.namelist()
+
+  def read(self, filename):
+    # members are compressed individually, so only the requested file is
+    # ever decompressed
+    with zipfile.ZipFile(self.archive_path) as archive:
+      return archive.read(filename)
+
+  def verify(self):
+    # blocking; reads every member back and checks its crc
+    try:
+      with zipfile.ZipFile(self.archive_path) as archive:
+        return archive.testzip() is None
+    except (OSError, zipfile.BadZipFile):
+      return False
+
+  def extract(self, game_path):
+    # blocking, meant to be run in an executor
+    with zipfile.ZipFile(self.archive_path) as archive:
+      archive.extractall(game_path)
+
+  def as_dict(self):
+    return dict(
+      archive = self.archive_path.name,
+      turn = self.turn,
+      settings = self.settings,
+      players = self.players
+    )
+
+class GameArchive:
+
+  def __init__(self, path):
+    self.path = Path(path)
+    self.path.mkdir(exist_ok = True)
+    self.index_path = self.path / "index.json"
+
+  def load(self):
+    if not self.index_path.exists(): return {}
+    with open(self.index_path, "r") as file:
+      index = json.load(file)
+    return {
+      name: ArchivedGame(
+        name,
+        archive_path = self.path / entry.pop("archive"),
+        **entry
+      ) for name, entry in index.items()
+    }
+
+  def save_index(self, archived_games):
+    index = {name: game.as_dict() for name, game in archived_games.items()}
+    tmp_path = self.index_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as file:
+      json.dump(index, file, indent = 2)
+    os.replace(tmp_path, self.index_path)
+
+  def pack(self, game):
+    # blocking, meant to be run in an executor
+    archive_path = self.path / f"{game.name}.zip"
+    tmp_path = archive_path.with_suffix(".tmp")
+    files = [file_path for file_path in sorted(game.path.rglob("*")) if file_path.is_file()]
+    with zipfile.ZipFile(tmp_path, "w", compression = zipfile.ZIP_LZMA) as archive:
+      for file_path in files:
+        archive.write(file_path, file_path.relative_to(game.path))
+    # the save directory is only removed once every file reads back intact
+    with zipfile.ZipFile(tmp_path) as archive:
+      intact = archive.testzip() is None and len(archive.namelist()) == len(files)
+    if not intact:
+      os.remove(tmp_path)
+      raise zipfile.BadZipFile(f"archive of {game.name} failed verification")
+    os.replace(tmp_path, archive_path)
+    shutil.rmtree(game.path)
+    return ArchivedGame(
+      game.name,
+      archive_path = archive_path,
+      turn = game.turn,
+      settings = game.settings,
+      players = game.players
+    )
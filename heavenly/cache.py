@@ -0,0 +1,56 @@
+from collections import OrderedDict
+
+class LRUCache:
+
+  def __init__(self, maxsize = 128):
+    self.maxsize = maxsize
+    self._entries = OrderedDict()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __contains__(self, key):
+    return key in self._entries
+
+  def get(self, key, default = None):
+    if key not in self._entries: return default
+    self._entries.move_to_end(key)
+    return self._entries[key]
+
+  def put(self, key, value):
+    self._entries[key] = value
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.maxsize:
+      self._entries.popitem(last = False)
+
+  def discard(self, key):
+    self._entries.pop(key, None)
+
+  def clear(self):
+    self._entries.clear()
+
+class ByteLRUCache(LRUCache):
+
+  def __init__(self, maxbytes, sizeof = len):
+    super().__init__(maxsize = None)
+    self.maxbytes = maxbytes
+    self.sizeof = sizeof
+    self.size = 0
+
+  def put(self, key, value):
+    self.discard(key)
+    size = self.sizeof(value)
+    if size > self.maxbytes: return
+    self._entries[key] = value
+    self.size += size
+    while self.size > self.maxbytes:
+      _, evicted = self._entries.popitem(last = False)
+      self.size -= self.sizeof(evicted)
+
+  def discard(self, key):
+    evicted = self._entries.pop(key, None)
+    if evicted is not None: self.size -= self.sizeof(evicted)
+
+  def clear(self):
+    super().clear()
+    self.size = 0
@@ -0,0 +1,426 @@
+import os
+import io
+import hmac
+import json
+import time
+import shutil
+import asyncio
+import secrets
+import zipfile
+import argparse
+from hashlib import sha256
+from base64 import b64encode, b64decode
+
+from .host import Host
+from .notify import Notifier
+from .events import EventBroadcaster
+from .state import GameView
+from .dom5 import STATUS_TURN_GEN
+from .config.app import SECRET_KEY
+from .config.cluster import (
+  CLUSTER_POLL_INTERVAL, CLUSTER_MESSAGE_LIMIT, CLUSTER_SECRET, CLUSTER_MAX_SKEW,
+  CLUSTER_VIEW_MAX_AGE
+)
+
+class ClusterError(Exception):
+  pass
+
+async def send_message(writer, message):
+  writer.write(json.dumps(message).encode("utf-8") + b"\n")
+  await writer.drain()
+
+async def read_message(reader):
+  line = await reader.readline()
+  if not line: raise ConnectionError("connection closed")
+  return json.loads(line)
+
+def cluster_key(secret = CLUSTER_SECRET):
+  return hmac.new(secret.encode("utf-8"), b"heavenly-cluster", sha256).digest()
+
+def sign_request(key, request):
+  body = json.dumps(dict(request, ts = time.time(), nonce = secrets.token_hex(16)))
+  return dict(body = body, mac = hmac.new(key, body.encode("utf-8"), sha256).hexdigest())
+
+class RequestVerifier:
+
+  def __init__(self, key):
+    self.key = key
+    self.seen = {}
+
+  def verify(self, message):
+    body = message.get("body") if isinstance(message, dict) else None
+    if not isinstance(body, str): raise ClusterError("unsigned request")
+    mac = hmac.new(self.key, body.encode("utf-8"), sha256).hexdigest()
+    if not hmac.compare_digest(mac, str(message.get("mac", ""))):
+      raise ClusterError("bad signature")
+    request = json.loads(body)
+    ts, nonce = request.pop("ts"), request.pop("nonce")
+    now = time.time()
+    # a captured request can't be replayed: it is either too old or its
+    # nonce was already seen inside the accepted window
+    if abs(now - ts) > CLUSTER_MAX_SKEW or nonce in self.seen:
+      raise ClusterError("stale or replayed request")
+    self.seen[nonce] = ts
+    for old in [n for n, seen_ts in self.seen.items() if now - seen_ts > CLUSTER_MAX_SKEW]:
+      del self.seen[old]
+    return request
+
+def pack_directory(path):
+  buffer = io.BytesIO()
+  with zipfile.ZipFile(buffer, "w", compression = zipfile.ZIP_DEFLATED) as archive:
+    for file_path in sorted(path.rglob("*")):
+      if file_path.is_file():
+        archive.write(file_path, file_path.relative_to(path))
+  return b64encode(buffer.getvalue()).decode("ascii")
+
+def unpack_directory(data, path):
+  path.mkdir(exist_ok = True)
+  with zipfile.ZipFile(io.BytesIO(b64decode(data))) as archive:
+    archive.extractall(path)
+
+def memory_available():
+  info = {}
+  with open("/proc/meminfo", "r") as file:
+    for line in file:
+      key, value, *_ = line.split()
+      info[key.rstrip(":")] = int(value)
+  return info.get("MemAvailable", 0) / max(info.get("MemTotal", 1), 1)
+
+class WorkerAgent:
+
+  def __init__(self, host, address = "127.0.0.1", port = 7100, key = None):
+    self.host = host
+    self.address = address
+    self.port = port
+    self.verifier = RequestVerifier(key or cluster_key())
+    # games handed to another worker wait here until it confirms the import
+    self.export_path = host.root / "exported"
+    self.export_path.mkdir(exist_ok = True)
+
+  async def serve(self):
+    await self.host.startup()
+    server = await asyncio.start_server(
+      self.handle_connection, self.address, self.port,
+      limit = CLUSTER_MESSAGE_LIMIT
+    )
+    async with server:
+      await server.serve_forever()
+
+  async def handle_connection(self, reader, writer):
+    try:
+      while True:
+        message = await read_message(reader)
+        try:
+          request = self.verifier.verify(message)
+        except (ClusterError, ValueError, KeyError, TypeError) as error:
+          await send_message(writer, dict(ok = False, error = f"unauthorized: {error}"))
+          break
+        try:
+          handler = getattr(self, "op_" + request.pop("op"))
+          response = dict(ok = True, result = await handler(**request))
+        except Exception as error:
+          response = dict(ok = False, error = f"{type(error).__name__}: {error}")
+        await send_message(writer, response)
+    except ConnectionError:
+      pass
+    finally:
+      writer.close()
+
+  def find_game(self, name):
+    game = self.host.find_game_by_name(name)
+    if not game: raise ClusterError(f"no game named {name}")
+    return game
+
+  async def op_status(self):
+    return dict(
+      load = os.getloadavg()[0],
+      cpus = os.cpu_count(),
+      memory_available = memory_available(),
+      turn_generations = len([*self.host.filter_games_by(state = STATUS_TURN_GEN)]),
+      games = self.host.game_summaries()
+    )
+
+  async def op_game_status(self, name):
+    game = self.find_game(name)
+    status = game.status()
+    status["thumbnail"] = game.map.thumbnail if game.map else None
+    return status
+
+  async def op_game_scores(self, name, metric, points):
+    self.find_game(name)
+    return dict(
+      version = self.host.scores.version(name),
+      scores = self.host.scores.sample(name, metric, points)
+    )
+
+  async def op_create_game(self, name, settings, notifiers = ()):
+    if self.host.find_game_by_name(name): raise ClusterError(f"{name} already exists")
+    settings["port"] = self.host.get_free_port()
+    game = self.host.create_new_game(
+      name, [Notifier._from_dict(n) for n in notifiers], **settings
+    )
+    game.start()
+    return game.summary()
+
+  async def op_export_game(self, name):
+    # first phase of a migration: the game stops and its directory moves
+    # out of savedgames, so a restart here won't bring it back, but nothing
+    # is deleted until the coordinator calls release_game
+    game = self.find_game(name)
+    await game.stop()
+    self.host.serialize_game(game)
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(None, pack_directory, game.path)
+    self.host.games.remove(game)
+    os.replace(game.path, self.export_path / name)
+    self.host.on_game_change(game)
+    return dict(name = name, data = data)
+
+  def find_exported(self, name):
+    export_path = self.export_path / name
+    if not export_path.is_dir(): raise ClusterError(f"{name} is not being exported")
+    return export_path
+
+  async def op_release_game(self, name):
+    export_path = self.find_exported(name)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, shutil.rmtree, export_path)
+    return dict(name = name)
+
+  async def op_restore_game(self, name):
+    export_path = self.find_exported(name)
+    game_path = self.host.savedgame_path / name
+    if self.host.find_game_by_name(name) or game_path.exists():
+      raise ClusterError(f"{name} already exists")
+    os.replace(export_path, game_path)
+    game = self.host.deserialize_game(game_path)
+    game.start()
+    self.host.on_game_change(game)
+    return game.summary()
+
+  async def op_import_game(self, name, data):
+    path = self.host.savedgame_path / name
+    if self.host.find_game_by_name(name) or path.exists():
+      raise ClusterError(f"{name} already exists")
+    loop = asyncio.get_running_loop()
+    try:
+      await loop.run_in_executor(None, unpack_directory, data, path)
+      game = self.host.deserialize_game(path)
+      if not game: raise ClusterError(f"{name} has no host data")
+      # ports are only unique per machine, so a migrated game gets a new one
+      game.settings["port"] = self.host.get_free_port()
+      self.host.serialize_game(game)
+    except Exception:
+      game = self.host.find_game_by_name(name)
+      if game: self.host.games.remove(game)
+      shutil.rmtree(path, ignore_errors = True)
+      raise
+    game.start()
+    return game.summary()
+
+class WorkerClient:
+
+  def __init__(self, address, port, key = None):
+    self.address = address
+    self.port = port
+    self.key = key or cluster_key()
+    self.status = None
+    self.draining = False
+    self.connection = None
+    self.lock = asyncio.Lock()
+
+  @property
+  def id(self):
+    return f"{self.address}:{self.port}"
+
+  async def call(self, op, **kwargs):
+    async with self.lock:
+      try:
+        if self.connection is None:
+          self.connection = await asyncio.open_connection(
+            self.address, self.port, limit = CLUSTER_MESSAGE_LIMIT
+          )
+        reader, writer = self.connection
+        await send_message(writer, sign_request(self.key, dict(op = op, **kwargs)))
+        response = await read_message(reader)
+      except (OSError, ConnectionError):
+        self.connection = None
+        self.status = None
+        raise
+    if not response["ok"]: raise ClusterError(response["error"])
+    return response["result"]
+
+  def score(self):
+    # lower is better; running turn generations dominate since those are
+    # the cpu spikes that hurt every other game on the machine
+    if not self.status: return float("inf")
+    status = self.status
+    return (status["load"] / max(status["cpus"], 1)
+            + (1 - status["memory_available"])
+            + status["turn_generations"]
+            + 0.01 * len(status["games"]))
+
+class Coordinator:
+
+  def __init__(self, workers, poll_interval = CLUSTER_POLL_INTERVAL, events = None):
+    self.workers = [WorkerClient(address, port) for address, port in workers]
+    self.poll_interval = poll_interval
+    self.version = 0
+    # worker games are announced on the web host's index stream, next to
+    # its own games
+    self.events = events or EventBroadcaster()
+    # worker games are shown through the same views a web worker uses for
+    # games it reads from the state store
+    self.game_views = {}
+    self.view_version = 0
+
+  async def refresh(self):
+    async def refresh_worker(worker):
+      try:
+        status = await worker.call("status")
+      except (OSError, ConnectionError, ClusterError):
+        status = None
+      if status != worker.status:
+        previous = {g["name"]: g for g in worker.status["games"]} if worker.status else {}
+        worker.status = status
+        self.version += 1
+        for summary in status["games"] if status else []:
+          if previous.get(summary["name"]) != summary:
+            self.events.publish("game", dict(summary, worker = worker.address))
+    await asyncio.gather(*(refresh_worker(worker) for worker in self.workers))
+
+    # open status streams are kept live; other views are fetched on demand
+    for name, view in list(self.game_views.items()):
+      if not view.events.subscribers: continue
+      try:
+        await self.game_view(name, max_age = 0)
+      except (OSError, ConnectionError, ClusterError):
+        pass
+
+  async def game_view(self, name, max_age = CLUSTER_VIEW_MAX_AGE):
+    worker = self.find_worker_for_game(name)
+    if not worker:
+      self.game_views.pop(name, None)
+      return None
+    view = self.game_views.get(name)
+    if view and view.worker is worker and time.monotonic() - view.fetched < max_age:
+      return view
+    status = await worker.call("game_status", name = name)
+    if view is None:
+      view = self.game_views[name] = GameView(name)
+      view.worker = view.remote_status = None
+    view.fetched = time.monotonic()
+    # a worker's versions restart with it and differ between workers, so
+    # views carry a version of the coordinator's own
+    if view.worker is not worker or status != view.remote_status:
+      view.worker, view.address, view.remote_status = worker, worker.address, status
+      self.view_version += 1
+      view.update(self.view_version, dict(status, version = self.view_version))
+    return view
+
+  async def game_scores(self, name, metric, points):
+    worker = self.find_worker_for_game(name)
+    if not worker: return None
+    scores = await worker.call("game_scores", name = name, metric = metric, points = points)
+    return dict(scores, worker = worker.id)
+
+  async def run(self):
+    while True:
+      await self.refresh()
+      await asyncio.sleep(self.poll_interval)
+
+  def find_worker(self, worker_id):
+    for worker in self.workers:
+      if worker.id == worker_id: return worker
+    return None
+
+  def find_worker_for_game(self, name):
+    for worker in self.workers:
+      if worker.status and any(g["name"] == name for g in worker.status["games"]):
+        return worker
+    return None
+
+  def game_summaries(self):
+    summaries = []
+    for worker in self.workers:
+      if not worker.status: continue
+      for summary in worker.status["games"]:
+        summaries.append(dict(summary, worker = worker.address))
+    return summaries
+
+  def pick_worker(self, exclude = ()):
+    candidates = [
+      worker for worker in self.workers
+      if worker.status and not worker.draining and worker not in exclude
+    ]
+    if not candidates: raise ClusterError("no worker available")
+    return min(candidates, key = WorkerClient.score)
+
+  async def place_game(self, name, settings, notifiers = ()):
+    if self.find_worker_for_game(name): raise ClusterError(f"{name} already exists")
+    worker = self.pick_worker()
+    notifiers = [notifier._as_dict() for notifier in notifiers]
+    summary = await worker.call(
+      "create_game", name = name, settings = settings, notifiers = notifiers
+    )
+    await self.refresh()
+    return worker, summary
+
+  async def migrate(self, name, target = None):
+    source = self.find_worker_for_game(name)
+    if not source: raise ClusterError(f"no worker runs {name}")
+    target = target or self.pick_worker(exclude = (source,))
+    exported = await source.call("export_game", name = name)
+    try:
+      summary = await target.call("import_game", **exported)
+    except (OSError, ConnectionError, ClusterError) as error:
+      # the import may have succeeded before the connection broke, so ask
+      # the target before the source is allowed to run the game again
+      try:
+        await target.call("game_status", name = name)
+        imported = True
+      except ClusterError:
+        imported = False
+      except (OSError, ConnectionError):
+        raise ClusterError(
+          f"{name} is stopped on {source.id} and its import on {target.id} is "
+          f"unconfirmed ({error}); it was neither released nor restarted"
+        )
+      if not imported:
+        await source.call("restore_game", name = name)
+        raise
+      summary = await target.call("game_status", name = name)
+    await source.call("release_game", name = name)
+    await self.refresh()
+    return target, summary
+
+  async def drain(self, worker_id):
+    worker = self.find_worker(worker_id)
+    if not worker: raise ClusterError(f"no worker {worker_id}")
+    worker.draining = True
+    await self.refresh()
+    for summary in list(worker.status["games"] if worker.status else []):
+      if not summary["finished"] and not summary.get("archived"):
+        await self.migrate(summary["name"])
+
+def main():
+  parser = argparse.ArgumentParser(description = "Run a heavenlyhost worker agent.")
+  parser.add_argument("--root", required = True, help = "host root directory")
+  parser.add_argument("--address", default = "127.0.0.1")
+  parser.add_argument("--port", type = int, default = 7100)
+  parser.add_argument("--port-range", type = int, nargs = 2, default = (1024, 65535))
+  args = parser.parse_args()
+
+  if args.address not in ("127.0.0.1", "localhost", "::1") and CLUSTER_SECRET == SECRET_KEY == "development key":
+    parser.error("set HEAVENLY_CLUSTER_SECRET (or SECRET_KEY) before listening on a network address")
+
+  host = Host(args.root, port_range = tuple(args.port_range))
+  host.restore_games()
+  agent = WorkerAgent(host, args.address, args.port)
+  try:
+    asyncio.run(agent.serve())
+  finally:
+    host.shutdown()
+
+if __name__ == "__main__":
+  main()
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 APP_NAME = "Heavenly Host"
@@ -7,3 +8,11 @@ MOTD = "Automated Dominions 5 server hosting."
 SRC_REPO_URL = "https://github.com/balinck/heavenlyhost"
 HOST_ROOT_PATH = Path("").resolve() / "data"
 HOST_PORT_RANGE = (1024, 65535)
+RENDER_CACHE_SIZE = 256
+MAP_PAGE_CACHE_SIZE = 64
+IMAGE_CACHE_BYTES = 32 * 1024 * 1024
+IMAGE_MAX_AGE = 7 * 24 * 60 * 60
+# "standalone" runs games inside the web process; "web" serves pages from the
+# state store written by a separately started `python -m heavenly.supervisor`
+HOST_MODE = os.environ.get("HEAVENLY_HOST_MODE", "standalone")
+MAX_TURN_FILE_BYTES = 16 * 1024 * 1024
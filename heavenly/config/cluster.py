@@ -0,0 +1,15 @@
+import os
+
+from .app import SECRET_KEY
+
+# (address, port) pairs of worker agents; leave empty to run games in-process
+CLUSTER_WORKERS = []
+CLUSTER_POLL_INTERVAL = 5
+# seconds a worker game's status is reused before the worker is asked again
+CLUSTER_VIEW_MAX_AGE = 2
+CLUSTER_MESSAGE_LIMIT = 256 * 1024 * 1024
+# every request between the coordinator and its workers is signed with a key
+# derived from this; it must be the same on every node
+CLUSTER_SECRET = os.environ.get("HEAVENLY_CLUSTER_SECRET") or SECRET_KEY
+# seconds a signed request stays valid, which bounds clock skew between nodes
+CLUSTER_MAX_SKEW = 60
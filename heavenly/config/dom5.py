@@ -1,3 +1,9 @@
+import os
 from pathlib import Path
 
-DOM5_PATH = Path(os.environ.get("DOM5_PATH")).resolve()
\ No newline at end of file
+DOM5_PATH = Path(os.environ.get("DOM5_PATH")).resolve()
+# seconds an admin command may wait for dom5 to pick up domcmd before it is
+# reported as unconfirmed
+COMMAND_CONFIRM_TIMEOUT = 120
+# bulk commands whose confirmations are shown on the admin page
+COMMAND_LOG_SIZE = 20
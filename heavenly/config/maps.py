@@ -1,4 +1,13 @@
 from pathlib import Path
 
 MAP_THUMBNAIL_DIR = Path("").resolve() / "img"
-MAP_THUMBNAIL_DIR.mkdir(exist_ok = True)
\ No newline at end of file
+MAP_THUMBNAIL_DIR.mkdir(exist_ok = True)
+
+MAP_TILE_DIR = Path("").resolve() / "tiles"
+MAP_TILE_DIR.mkdir(exist_ok = True)
+MAP_TILE_SIZE = 256
+MAP_TILE_CACHE_BYTES = 512 * 1024 * 1024
+MAP_TILE_SOURCE_CACHE_BYTES = 128 * 1024 * 1024
+# seconds between rescans of the tile directory, which count the tiles web
+# workers render into it against MAP_TILE_CACHE_BYTES
+MAP_TILE_RESCAN_INTERVAL = 300
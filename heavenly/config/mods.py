@@ -1,4 +1,4 @@
 from pathlib import Path
 
 MOD_ICON_DIR = Path("").resolve() / "img"
-MOD_ICON_DIR.mkdir(exist_ok = True)
\ No newline at end of file
+MOD_ICON_DIR.mkdir(exist_ok = True)
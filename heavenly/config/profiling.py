@@ -0,0 +1,11 @@
+import os
+
+# set HEAVENLY_PROFILE=1 to time the hot paths and sample the event loop;
+# it has to be set before the app is imported
+PROFILE_ENABLED = os.environ.get("HEAVENLY_PROFILE", "") not in ("", "0")
+# seconds between stack samples of the event loop thread
+PROFILE_SAMPLE_INTERVAL = 0.01
+# an event loop blocked this many seconds is reported as a slow callback
+PROFILE_SLOW_CALLBACK = 0.1
+# seconds between rewrites of the collapsed stack file
+PROFILE_DUMP_INTERVAL = 60
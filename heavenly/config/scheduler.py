@@ -0,0 +1,2 @@
+# seconds before a turn is hosted at which players who haven't played are reminded
+REMINDER_OFFSETS = (12 * 60 * 60, 60 * 60)
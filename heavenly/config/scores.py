@@ -0,0 +1,4 @@
+# games whose score series are kept in memory at once
+SCORE_CACHE_GAMES = 64
+# most points a score chart is sampled down to
+SCORE_CHART_POINTS = 120
@@ -0,0 +1,5 @@
+from .app import HOST_ROOT_PATH
+
+STATE_DB_PATH = HOST_ROOT_PATH / "state.sqlite3"
+STATE_FLUSH_INTERVAL = 0.5
+STATE_POLL_INTERVAL = 1
@@ -0,0 +1,2 @@
+# seconds between directory scans where inotify is unavailable
+WATCH_POLL_INTERVAL = 2
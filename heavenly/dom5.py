@@ -1,4 +1,3 @@
-import shlex
 import asyncio
 from pathlib import Path
 import os
@@ -6,6 +5,7 @@ import re
 from collections import deque
 
 from .config.dom5 import DOM5_PATH
+from .profiling import timed
 
 STATUS_TIMEOUT = "timed out"
 STATUS_MAPGEN = "generating random map"
@@ -40,6 +40,8 @@ class Setup(GameUpdate):
 
   def __init__(self, match):
     super().__init__(match)
+    # compared against ints when looking for a free port
+    self.port = int(self.port)
     self.state = STATUS_SETUP
 
 class Mapgen(GameUpdate):
@@ -117,8 +119,8 @@ class Dom5Process:
       elif value:
         cl_args.append("--" + key)
         if type(value) is not bool:
+          # passed as a single argument, so hook commands keep their spaces
           cl_args.append(str(value))
-    cl_args = shlex.split(" ".join(cl_args))
     self.process = asyncio.create_subprocess_exec(str(DOM5_PATH / "dom5_amd64"), 
       *cl_args, stdin = stdin, 
       stdout = stdout, stderr = stderr
@@ -167,12 +169,15 @@ class TCPServer(Dom5Process):
     while not self.process.stdout.at_eof():
       line = await self.process.stdout.readline()
       if line:
-        line = line.decode()
-        #print(f"{self.port}: {line}")
-        for update_type in type(self).update_types:
-          update = update_type.match(line)
-          if update:
-            self.update_queue.append(update)
+        self.parse_line(line.decode())
+
+  @timed("dom5.parse_line")
+  def parse_line(self, line):
+    #print(f"{self.port}: {line}")
+    for update_type in type(self).update_types:
+      update = update_type.match(line)
+      if update:
+        self.update_queue.append(update)
 
   async def check_for_gameover(self):
     await self.process.wait()
@@ -240,7 +245,7 @@ GAME_DEFAULTS = {
   "randmap": 15,                # --randmap X     Make and use a random map with X prov per player (10,15,20)
   "noclientstart": False,       # --noclientstart Clients cannot start the game during Choose Participants
   "statuspage": False,          # --statuspage XX Create html page that shows who needs to play their turn
-  "scoredump": False,           # --scoredump     Create a score file after each turn (scores.html)
+  "scoredump": True,            # --scoredump     Create a score file after each turn (scores.html)
   "enablemod": False,           # --enabledmod    Enable the mod with filename XXX
 # World Contents
   "magicsites": 50,             # --magicsites X  Magic site frequency 0-75 (default 40)
@@ -0,0 +1,40 @@
+import asyncio
+import json
+
+class EventBroadcaster:
+
+  def __init__(self, maxsize = 64):
+    self.maxsize = maxsize
+    self.subscribers = set()
+
+  def subscribe(self):
+    queue = asyncio.Queue(maxsize = self.maxsize)
+    self.subscribers.add(queue)
+    return queue
+
+  def unsubscribe(self, queue):
+    self.subscribers.discard(queue)
+
+  def publish(self, event, data):
+    if not self.subscribers: return
+    # encode once, no matter how many clients are listening
+    message = format_event(event, data)
+    for queue in list(self.subscribers):
+      try:
+        queue.put_nowait(message)
+      except asyncio.QueueFull:
+        # slow consumers only ever need the latest state
+        queue.get_nowait()
+        queue.put_nowait(message)
+
+  async def stream(self, initial = None):
+    queue = self.subscribe()
+    try:
+      if initial: yield initial
+      while True:
+        yield await queue.get()
+    finally:
+      self.unsubscribe(queue)
+
+def format_event(event, data):
+  return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
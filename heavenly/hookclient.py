@@ -0,0 +1,21 @@
+# Deliberately standalone: dom5 runs this once per turn for every game, so it
+# imports nothing beyond socket and sys and is started with `python -S -E`.
+import sys
+import socket
+
+def main(socket_path, event, name):
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  client.settimeout(60)
+  try:
+    client.connect(socket_path)
+    client.sendall(f"{event} {name}\n".encode("utf-8"))
+    # wait for the host to finish its hooks before dom5 carries on
+    reply = client.recv(64)
+  except OSError:
+    return 1
+  finally:
+    client.close()
+  return 0 if reply.startswith(b"ok") else 1
+
+if __name__ == "__main__":
+  sys.exit(main(*sys.argv[1:4]))
@@ -0,0 +1,54 @@
+import os
+import sys
+import asyncio
+import shlex
+from pathlib import Path
+
+HOOK_EVENTS = ("preexec", "postexec")
+HOOK_CLIENT_PATH = Path(__file__).resolve().parent / "hookclient.py"
+
+class HookServer:
+
+  def __init__(self, host, path):
+    self.host = host
+    self.path = Path(path)
+    self.server = None
+
+  def command(self, event, game):
+    return " ".join(shlex.quote(arg) for arg in (
+      sys.executable, "-S", "-E", str(HOOK_CLIENT_PATH),
+      str(self.path), event, game.name
+    ))
+
+  async def start(self):
+    # anyone who can connect can run a game's hooks, so the socket lives in
+    # a directory only this user can enter
+    try:
+      self.path.parent.mkdir(mode = 0o700, exist_ok = True)
+      os.chmod(self.path.parent, 0o700)
+      if self.path.exists(): self.path.unlink()
+      self.server = await asyncio.start_unix_server(self.handle_connection, str(self.path))
+      os.chmod(self.path, 0o600)
+    except OSError as error:
+      # e.g. a root deep enough to pass the ~108 byte socket path limit;
+      # games then start without hook commands rather than not at all
+      print(f"turn hooks disabled, {self.path} could not be bound: {error!r}")
+      self.close()
+      self.server = None
+
+  def close(self):
+    if self.server: self.server.close()
+
+  async def handle_connection(self, reader, writer):
+    try:
+      line = (await reader.readline()).decode("utf-8").strip()
+      event, _, name = line.partition(" ")
+      game = self.host.find_game_by_name(name)
+      if event in HOOK_EVENTS and game:
+        await getattr(game, "on_" + event)()
+        writer.write(b"ok\n")
+      else:
+        writer.write(b"unknown\n")
+      await writer.drain()
+    finally:
+      writer.close()
@@ -1,30 +1,59 @@
 import os
 import json
 import io
+import shutil
+import zipfile
 import asyncio
 from copy import copy
 from pathlib import Path
-from collections import namedtuple
+from collections import namedtuple, deque
 import re
+import time
+import itertools
 
 from .notify import Notifier
-from .maps import Dom5Map
-from .mods import Dom5Mod
+from .events import EventBroadcaster
+from .maps import Dom5Map, MapIndex
+from .tiles import TileCache
+from .archive import GameArchive
+from .snapshots import SnapshotStore
+from .scores import ScoreStore, read_scores
+from .hooks import HookServer, HOOK_EVENTS
+from .watch import TurnFileWatcher
+from .scheduler import DeadlineScheduler, TurnReminders, parse_time_until_host
+from .mods import scan_mods
+from .config.maps import MAP_TILE_RESCAN_INTERVAL
+from .config.dom5 import COMMAND_CONFIRM_TIMEOUT, COMMAND_LOG_SIZE
+from .profiling import profiler, timed
 from .dom5 import GAME_DEFAULTS, TCPServer, list_nations, STATUS_TURN_GEN, STATUS_ACTIVE, STATUS_INIT, STATUS_SETUP, STATUS_MAPGEN, DOM5_PATH
 
 class Host:
 
+  readonly = False
+
   def __init__(
       self, 
       root_path,
       dom5_path = DOM5_PATH,
-      port_range = (1024, 65535)
+      port_range = (1024, 65535),
+      mirror = False
       ):
     self.games = []
+    # a mirror (a web worker in front of the supervisor) reads the library
+    # but leaves thumbnails and tile eviction to the supervisor
+    self.mirror = mirror
     self.maps = []
     self.mods = []
 
     self.status = {}
+    self.events = EventBroadcaster()
+    self.game_change_callbacks = []
+    # versions restart with the process, so etags carry the start time too
+    self.epoch = int(time.time())
+    self.version = 0
+    # game versions are drawn from one counter, so a game recreated or
+    # unarchived under an old name never repeats a version it had before
+    self.game_versions = itertools.count(1)
 
     self.port_range = port_range
 
@@ -34,6 +63,9 @@ class Host:
     self.savedgame_path = self.root / "savedgames"
     self.map_path = self.root / "maps"
     self.mod_path = self.root / "mods"
+    self.archive_path = self.root / "archive"
+    self.snapshot_path = self.root / "snapshots"
+    self.score_path = self.root / "scores"
 
     os.environ["DOM5_CONF"] = str(self.conf_path)
     os.environ["DOM5_SAVE"] = str(self.savedgame_path)
@@ -44,13 +76,35 @@ class Host:
                  self.map_path, self.mod_path):
       path.mkdir(exist_ok=True)
 
+    self.library_version = 0
+    self.tile_cache = TileCache(managed = not mirror)
+    self.scan_library()
+    self.archive = GameArchive(self.archive_path)
+    self.archived_games = self.archive.load()
+    self.snapshots = SnapshotStore(self.snapshot_path)
+    self.scores = ScoreStore(self.score_path)
+    self.scheduler = DeadlineScheduler()
+    self.hooks = HookServer(self, self.root / "hooks" / "hooks.sock")
+    self.watcher = TurnFileWatcher()
+    self.reminders = TurnReminders(self.scheduler)
+    self.command_log = deque(maxlen = COMMAND_LOG_SIZE)
+
+  def scan_library(self):
+    maps = []
     for file_path in self.map_path.iterdir():
       if file_path.suffix == ".map":
-        self.maps.append(Dom5Map(file_path))
+        maps.append(Dom5Map(file_path, write_thumbnail = not self.mirror))
+
+    mods = scan_mods(
+      (file_path for file_path in self.mod_path.iterdir()
+       if file_path.suffix == ".dm"),
+      write_thumbnails = not self.mirror
+    )
 
-    for file_path in self.mod_path.iterdir():
-      if file_path.suffix == ".dm":
-        self.mods.append(Dom5Mod(file_path))
+    self.maps, self.mods = maps, mods
+    self.map_index = MapIndex(maps)
+    self.tile_cache.reset()
+    self.library_version += 1
 
   def get_free_port(self):
     lower, upper = self.port_range
@@ -72,8 +126,82 @@ class Host:
       host = self
     )
     self.games.append(game)
+    self.on_game_change(game)
     return game
 
+  def on_game_change(self, game, summary_changed = True):
+    # the game list only carries summaries, so only those bump its version
+    if summary_changed:
+      self.version += 1
+      self.events.publish("game", game.summary())
+    for callback in self.game_change_callbacks: callback(game)
+
+  def game_summaries(self):
+    summaries = [game.summary() for game in self.games]
+    summaries.extend(game.summary() for game in self.archived_games.values())
+    return summaries
+
+  async def archive_game(self, game):
+    # a game still in progress can't be archived; it would be marked
+    # finished and never resume where it was
+    if not game.finished: return None
+    loop = asyncio.get_running_loop()
+    await game.stop()
+    self.serialize_game(game)
+    try:
+      archived = await loop.run_in_executor(None, self.archive.pack, game)
+    except (OSError, zipfile.BadZipFile) as error:
+      print(f"{game.name}: archiving failed, keeping its save directory: {error!r}")
+      return None
+    self.games.remove(game)
+    self.archived_games[game.name] = archived
+    self.archive.save_index(self.archived_games)
+    self.on_game_change(archived)
+    return archived
+
+  async def archive_finished(self):
+    archived = []
+    for game in list(self.filter_games_by(finished = True)):
+      if await self.archive_game(game): archived.append(game.name)
+    return archived
+
+  async def unarchive_game(self, name):
+    loop = asyncio.get_running_loop()
+    archived = self.archived_games[name]
+    game_path = self.savedgame_path / name
+    if not (game_path / "host_data.json").exists():
+      await loop.run_in_executor(None, archived.extract, game_path)
+    game = self.deserialize_game(game_path)
+    if not game: return None
+    del self.archived_games[name]
+    self.archive.save_index(self.archived_games)
+    archived.archive_path.unlink()
+    game.publish_status()
+    if not game.finished: game.start()
+    return game
+
+  async def bulk_command(self, games, command, timeout = COMMAND_CONFIRM_TIMEOUT):
+    # the log entry is filled in as dom5 picks the command up, so the admin
+    # page shows confirmations without the request waiting for them
+    results = {game.name: "queued" for game in games}
+    self.command_log.appendleft(dict(command = command, at = time.time(), results = results))
+    futures = {game.name: game.queue_command(command) for game in games}
+    for name, future in futures.items():
+      future.add_done_callback(
+        lambda future, name = name: results.__setitem__(
+          name, "cancelled" if future.cancelled() else "confirmed"
+        )
+      )
+    if futures: await asyncio.wait(futures.values(), timeout = timeout)
+    for name, future in futures.items():
+      if not future.done(): results[name] = "unconfirmed"
+    return results
+
+  def find_map_by_filename(self, filename):
+    for _map in self.maps:
+      if _map.filename == filename: return _map
+    return None
+
   def filter_games_by(self, **kwargs):
     def filter_func(g):
       matches = []
@@ -104,6 +232,7 @@ class Host:
         host = self
       )
       self.games.append(game)
+      return game
     else:
       print("no json data found in {}".format(json_path.parent))
 
@@ -118,6 +247,9 @@ class Host:
       save_path = Path(dirname)
       if save_path.samefile(self.savedgame_path):
         pass
+      elif save_path.name in self.archived_games:
+        # left behind by an older host that archived without removing it
+        if self.archived_games[save_path.name].verify(): shutil.rmtree(save_path)
       else:
         self.deserialize_game(save_path)
 
@@ -126,12 +258,26 @@ class Host:
       self.serialize_game(game)
 
   async def startup(self):
+    profiler.start(self.root / "profile-host.folded")
+    asyncio.create_task(self.scheduler.run())
+    asyncio.create_task(self.maintain_tiles())
+    self.watcher.start()
+    await self.hooks.start()
     self.nations = await list_nations()
     for game in self.games:
       if not game.finished:
-        asyncio.create_task(game.run_until_cancelled())
+        game.start()
+
+  async def maintain_tiles(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      await asyncio.sleep(MAP_TILE_RESCAN_INTERVAL)
+      await loop.run_in_executor(None, self.tile_cache.rescan)
 
   def shutdown(self):
+    profiler.stop()
+    self.hooks.close()
+    self.watcher.close()
     self.dump_games()
     for game in self.games: game.shutdown()
 
@@ -176,6 +322,24 @@ class Game:
               self.map = Dom5Map(file_path)
               break
 
+    @self.when_status_change("state")
+    def snapshot_on_new_turn(prev, new):
+      if new == STATUS_ACTIVE and prev in (STATUS_TURN_GEN, STATUS_SETUP, STATUS_MAPGEN):
+        if self.host:
+          loop = asyncio.get_running_loop()
+          snapshot = loop.run_in_executor(
+            None, self.host.snapshots.snapshot, self.name, self.turn, self.path
+          )
+          snapshot.add_done_callback(
+            lambda future, turn = self.turn: self._report_snapshot(future, turn)
+          )
+
+    @self.when_status_change("state")
+    def clear_submissions_on_turn_gen(prev, new):
+      if new == STATUS_TURN_GEN and self.submissions:
+        prev_submissions, self.submissions = self.submissions, {}
+        self.on_status_change("submissions", prev_submissions, {})
+
     @self.when_status_change("players")
     def init_player_roster(prev, new):
       if not prev and new:
@@ -196,6 +360,42 @@ class Game:
           )
         self.players = roster
 
+    @self.when_hook("postexec")
+    async def ingest_scores():
+      if not self.host: return
+      scores = self.host.scores
+      loop = asyncio.get_running_loop()
+      result = await loop.run_in_executor(
+        None, read_scores, self.path, scores.last_mtime(self.name)
+      )
+      # postexec runs before the turn counter advances
+      if result and result[1]: scores.append(self.name, self.turn + 1, *result)
+
+    @self.when_status_change("time_until_host")
+    def schedule_turn_reminders(prev, new):
+      if self.host and self.state == STATUS_ACTIVE:
+        self.host.reminders.update_deadline(self, parse_time_until_host(new))
+
+    @self.when_status_change("state")
+    def clear_turn_reminders(prev, new):
+      if self.host and new != STATUS_ACTIVE:
+        self.host.reminders.clear(self)
+
+    @self.when_status_change("state")
+    def schedule_turn_reminders_on_active(prev, new):
+      # an Active update sets time_until_host before state, so the first
+      # countdown of a turn (or one unchanged from the last) lands here
+      if self.host and new == STATUS_ACTIVE:
+        self.host.reminders.update_deadline(
+          self, parse_time_until_host(self.__dict__.get("time_until_host"))
+        )
+
+    @self.when_status_change("finished")
+    def archive_on_game_over(prev, new):
+      if new and self.host:
+        loop = asyncio.get_running_loop()
+        loop.create_task(self.host.archive_game(self))
+
     @self.when_status_change("who_played")
     def check_for_eliminations(prev, new):
       if not prev or len(new) < len(prev):
@@ -229,6 +429,10 @@ class Game:
     self.finished = finished
 
     self.process = None
+    self.task = None
+    self.pending_commands = []
+    self.sent_commands = []
+    self.flush_scheduled = False
 
     self.path = path
     self.dom5_path = dom5_path
@@ -242,6 +446,8 @@ class Game:
       self.notifiers = notifiers
 
     self.turn = turn
+    self.submissions = {}
+    self.turn_files = {}
     self.settings = copy(game_settings)
     if not players:
       players = {}
@@ -255,7 +461,11 @@ class Game:
     self._init_map_obj()
 
     self.state = STATUS_INIT
+    self.version = next(host.game_versions) if host else 0
+    self._published_summary = None
+    self.events = EventBroadcaster()
     self.status_change_triggers = {}
+    self.hook_triggers = {}
     self._default_triggers()
 
   def as_dict(self):
@@ -294,7 +504,13 @@ class Game:
     return game
 
   async def run_until_cancelled(self):
-    self.process = TCPServer(self.name, **self.settings)
+    settings = copy(self.settings)
+    if self.host and self.host.hooks.server:
+      # turn hooks come back to this process instead of spawning anything
+      # heavier than the tiny hook client
+      for event in HOOK_EVENTS:
+        if not settings.get(event): settings[event] = self.host.hooks.command(event, self)
+    self.process = TCPServer(self.name, **settings)
     tasks = asyncio.gather(self.process.run(), self.receive_updates())
     try:
       await tasks
@@ -310,6 +526,7 @@ class Game:
   async def receive_updates(self):
     while True:
       await asyncio.sleep(1)
+      if self.pending_commands or self.sent_commands: self.flush_commands()
       while self.process and self.process.has_updates():
         update = self.process.update_queue.popleft()
         for key, value in update.__dict__.items():
@@ -318,10 +535,65 @@ class Game:
             self.__dict__[key] = value
             self.on_status_change(key, prev, value)
 
+  @timed("game.on_status_change")
   def on_status_change(self, name, prev, new):
     if self.status_change_triggers.get(name):
       for func in self.status_change_triggers.get(name):
         func(prev, new)
+    self.publish_status()
+
+  def publish_status(self):
+    self.version = next(self.host.game_versions) if self.host else self.version + 1
+    self.events.publish("status", self.status())
+    summary = self.summary()
+    summary_changed = summary != self._published_summary
+    self._published_summary = summary
+    if self.host: self.host.on_game_change(self, summary_changed)
+
+  def summary(self):
+    return dict(
+      name = self.name,
+      state = self.state,
+      turn = self.turn,
+      finished = self.finished,
+      port = self.settings["port"]
+    )
+
+  def player_status(self):
+    played = {wp[0]: wp for wp in self.__dict__.get("who_played", [])}
+    submitted = {nation_key(stem): ts for stem, ts in self.submissions.items()}
+    players = []
+    for player in self.players:
+      submission = submitted.get(nation_key(player["name"].split(",")[0]))
+      if player["eliminated"]:
+        turn, connected = "eliminated", False
+      elif player["shortname"] in played:
+        _, turn, connected = played[player["shortname"]]
+      else:
+        turn, connected = "unknown", False
+      # the .2h shows up on disk before dom5 reports it on stdout; a turn
+      # dom5 calls unfinished was saved but not ended, so it stays that way
+      if submission and turn in ("-", "unknown"): turn = "played"
+      players.append((player["name"], turn, connected, submission))
+    return players
+
+  def on_turn_file(self, filename, timestamp):
+    stem, _, suffix = filename.rpartition(".")
+    name = "submissions" if suffix == "2h" else "turn_files"
+    prev = self.__dict__[name]
+    new = dict(prev)
+    new[stem] = timestamp
+    self.__dict__[name] = new
+    self.on_status_change(name, prev, new)
+
+  def status(self):
+    status = self.summary()
+    status.update(
+      version = self.version,
+      connections = self.__dict__.get("connections"),
+      players = self.player_status()
+    )
+    return status
 
   def when_status_change(self, name):
     def interior_decorator(func):
@@ -341,19 +613,125 @@ class Game:
       self.process.die()
     self.process = None
 
-  def restart(self):
-    self.shutdown()
-    self.setup()
+  def start(self):
+    if self.host: self.host.watcher.watch(self)
+    self.task = asyncio.create_task(self.run_until_cancelled())
+    return self.task
+
+  async def stop(self):
+    if self.host:
+      self.host.watcher.unwatch(self)
+      # a stopped, archived or migrated game must not be reminded about
+      self.host.reminders.clear(self)
+    if self.task:
+      self.task.cancel()
+      try:
+        await self.task
+      except asyncio.CancelledError:
+        pass
+    self.task = None
+    # after the process is gone, so whether dom5 read domcmd is settled
+    self.cancel_commands()
+
+  async def restart(self):
+    await self.stop()
+    self.start()
+
+  def snapshot_turns(self):
+    return self.host.snapshots.turns(self.name)
+
+  async def rollback(self, turn):
+    loop = asyncio.get_running_loop()
+    await self.stop()
+    snapshots = self.host.snapshots
+    await loop.run_in_executor(None, snapshots.restore, self.name, turn, self.path)
+    snapshots.discard(self.name, turn)
+    # objects only the discarded turns referenced are reclaimed right away
+    await loop.run_in_executor(None, snapshots.prune)
+    self.turn = turn
+    self.state = STATUS_INIT
+    self.publish_status()
+    self.host.serialize_game(self)
+    self.start()
+
+  def _report_snapshot(self, future, turn):
+    if not future.cancelled() and future.exception():
+      print(f"{self.name}: snapshot of turn {turn} failed: {future.exception()!r}")
 
   def domcmd(self, command):
-    with open(self.path / "domcmd", "x") as file:
-      file.write(command)
+    return self.queue_command(command)
+
+  def queue_command(self, command):
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    self.pending_commands.append((command, future))
+    # commands queued during the same tick go out in one domcmd write
+    if not self.flush_scheduled:
+      self.flush_scheduled = True
+      loop.call_soon(self._scheduled_flush)
+    return future
+
+  def _scheduled_flush(self):
+    self.flush_scheduled = False
+    self.flush_commands()
+
+  def cancel_commands(self):
+    # a stopped game's dom5 will never confirm them, and a domcmd it didn't
+    # read would otherwise run on its next start (or after a rollback)
+    domcmd_path = self.path / "domcmd"
+    if self.sent_commands and not domcmd_path.exists():
+      # read before dom5 stopped
+      for _, future in self.sent_commands:
+        if not future.done(): future.set_result(True)
+      self.sent_commands = []
+    try:
+      domcmd_path.unlink()
+    except FileNotFoundError:
+      pass
+    for _, future in self.pending_commands + self.sent_commands:
+      future.cancel()
+    self.pending_commands, self.sent_commands = [], []
+
+  def flush_commands(self):
+    domcmd_path = self.path / "domcmd"
+    if domcmd_path.exists(): return
+    # dom5 deletes domcmd once it has read it
+    for _, future in self.sent_commands:
+      if not future.done(): future.set_result(True)
+    self.sent_commands = []
+    if not self.pending_commands: return
+
+    batch, self.pending_commands = self.pending_commands, []
+    tmp_path = self.path / "domcmd.tmp"
+    with open(tmp_path, "w") as file:
+      file.write("\n".join(command for command, _ in batch) + "\n")
+    os.replace(tmp_path, domcmd_path)
+    self.sent_commands = batch
 
   def force_next_turn(self):
-    self.domcmd("settimeleft 1")
+    return self.queue_command("settimeleft 1")
+
+  def when_hook(self, event):
+    def interior_decorator(func):
+      self.hook_triggers.setdefault(event, []).append(func)
+      return func
+    return interior_decorator
+
+  async def run_hooks(self, event):
+    for func in self.hook_triggers.get(event, []):
+      try:
+        result = func()
+        if asyncio.iscoroutine(result): await result
+      except Exception as error:
+        print(f"{self.name}: {event} hook {func.__name__} failed: {error}")
+
+  async def on_preexec(self):
+    await self.run_hooks("preexec")
 
-  def on_preexec(self):
-    pass
+  async def on_postexec(self):
+    await self.run_hooks("postexec")
 
-  def on_postexec(self):
-    pass
+def nation_key(name):
+  # "early_tienchi" (a turn file) and "T'ien Ch'i" (a nation) both become "tienchi"
+  name = name.rpartition("_")[2] if "_" in name else name
+  return "".join(c for c in name.lower() if c.isalpha())
@@ -1,52 +1,220 @@
 from PIL import Image
 from pathlib import Path
 from copy import copy
+from array import array
+from collections import Counter
+import os
+import re
+import tempfile
+from bisect import bisect_left, bisect_right
 
 from .config.maps import MAP_THUMBNAIL_DIR
 
+TERRAIN_TYPES = {
+	"small": 1 << 0,
+	"large": 1 << 1,
+	"sea": 1 << 2,
+	"freshwater": 1 << 3,
+	"highlands": 1 << 4,
+	"swamp": 1 << 5,
+	"waste": 1 << 6,
+	"forest": 1 << 7,
+	"farm": 1 << 8,
+	"nostart": 1 << 9,
+	"manysites": 1 << 10,
+	"deepsea": 1 << 11,
+	"cave": 1 << 12,
+	"mountains": 1 << 22,
+	"throne": 1 << 24,
+	"start": 1 << 25,
+}
+UNDERWATER_MASK = TERRAIN_TYPES["sea"] | TERRAIN_TYPES["deepsea"]
+
+DIRECTIVE_REGEX = re.compile(r"^#(\w+)[ \t]*([^\r\n]*)", re.M)
+DESCRIPTION_REGEX = re.compile(r"^#description[ \t]+\"(.*?)\"", re.M | re.S)
+
+def save_thumbnail(image_path, thumbnail_dir, thumbnail):
+	# unique temp files, so a reader never sees a half written thumbnail
+	with Image.open(image_path) as im:
+		im.thumbnail((256, 256))
+		im = im.convert("RGB")
+		for filename, format in ((thumbnail, "JPEG"), (thumbnail + ".webp", "WEBP")):
+			fd, tmp_path = tempfile.mkstemp(dir = thumbnail_dir, suffix = ".tmp")
+			try:
+				with os.fdopen(fd, "wb") as file:
+					im.save(file, format)
+				os.replace(tmp_path, thumbnail_dir / filename)
+			except BaseException:
+				os.unlink(tmp_path)
+				raise
+
 class Dom5Map:
 
-	def __init__(self, path_to_map):
+	def __init__(self, path_to_map, write_thumbnail = True):
 		self.filename = path_to_map.name
+		self.path = path_to_map
+		self.winter_tga = None
 		self.provinces = 0
 		self.underwater = 0
 		self.wraparound = "No"
 
-		with open(path_to_map, "r") as file:
-			line = file.readline()
-			eof = not line
-			while not eof:
-				if line.startswith("--"): pass
-				elif line.startswith("#"):
-					command, *args = line.split()
-
-					if command == "#dom2title": self.title = " ".join(args)
-					elif command == "#imagefile": self.tga = " ".join(args)
-					elif command == "#winterimagefile": self.winter_tga = " ".join(args)
-					elif command == "#wraparound": self.wraparound = "Full"
-					elif command == "#hwraparound": self.wraparound = "Horizontal"
-					elif command == "#vwraparound": self.wraparound = "Vertical"
-
-					elif command == "#description":
-						self.description = [" ".join(args)]
-						while not line.endswith("\"\n"):
-							line = file.readline()
-							self.description.append(line)
-						self.description = "<br>".join(self.description)
-						self.description = self.description.replace("\n", "")
-						self.description = self.description.replace("\"", "")
-
-					elif command == "#terrain":
-						self.provinces += 1
-						terrain_mask = format(int(args[1]) + (2**31), "b")
-						if any(int(terrain_mask[n]) for n in (-3, -12)): self.underwater += 1
-
-				line = file.readline()
-				eof = not bool(line)
-
-		with Image.open(path_to_map.parent / self.tga) as im:
-			self.thumbnail = (self.title + ".thumbnail").replace(" ", "")
-			im.thumbnail((256, 256))
-			im = im.convert("RGB")
-			im.save(MAP_THUMBNAIL_DIR / self.thumbnail, "JPEG")
+		with open(path_to_map, "r", errors = "replace") as file:
+			text = file.read()
+
+		masks = array("q")
+		edges = array("I")
+		for match in DIRECTIVE_REGEX.finditer(text):
+			command, args = match.groups()
+
+			if command == "terrain":
+				masks.append(int(args.split()[1]))
+			elif command == "neighbour":
+				edges.extend(int(arg) for arg in args.split()[:2])
+			elif command == "dom2title": self.title = " ".join(args.split())
+			elif command == "imagefile": self.tga = args.strip()
+			elif command == "winterimagefile": self.winter_tga = args.strip()
+			elif command == "wraparound": self.wraparound = "Full"
+			elif command == "hwraparound": self.wraparound = "Horizontal"
+			elif command == "vwraparound": self.wraparound = "Vertical"
+
+		match = DESCRIPTION_REGEX.search(text)
+		if match:
+			lines = match.group(1).replace("\r", "").split("\n")
+			self.description = "<br>".join(lines).replace("\"", "")
+
+		self.provinces = len(masks)
+		self.terrain_counts = count_terrain(masks)
+		self.underwater = sum(
+			count for mask, count in Counter(masks).items() if mask & UNDERWATER_MASK
+		)
+		self._build_adjacency(edges)
+
+		self.thumbnail = (self.title + ".thumbnail").replace(" ", "")
+		if write_thumbnail:
+			save_thumbnail(path_to_map.parent / self.tga, MAP_THUMBNAIL_DIR, self.thumbnail)
+
+	def _build_adjacency(self, edges):
+		# compressed sparse rows: the neighbours of province p (1-based) are
+		# adjacency[adjacency_offsets[p - 1]:adjacency_offsets[p]]
+		count = max(self.provinces, max(edges, default = 0))
+		pairs = set()
+		for a, b in zip(edges[0::2], edges[1::2]):
+			if a != b:
+				pairs.add((a, b))
+				pairs.add((b, a))
+
+		degrees = array("I", bytes(4 * (count + 1)))
+		for a, _ in pairs: degrees[a] += 1
+		self.adjacency_offsets = array("I", [0])
+		for province in range(1, count + 1):
+			self.adjacency_offsets.append(self.adjacency_offsets[-1] + degrees[province])
+		self.adjacency = array("I", (b for _, b in sorted(pairs)))
+
+	def neighbours(self, province):
+		start, end = self.adjacency_offsets[province - 1], self.adjacency_offsets[province]
+		return self.adjacency[start:end]
+
+	def degree(self, province):
+		return self.adjacency_offsets[province] - self.adjacency_offsets[province - 1]
+
+	@property
+	def average_degree(self):
+		provinces = len(self.adjacency_offsets) - 1
+		return len(self.adjacency) / provinces if provinces else 0.0
+
+	@property
+	def water_ratio(self):
+		return self.underwater / self.provinces if self.provinces else 0.0
+
+def count_terrain(masks):
+	# maps reuse a handful of terrain masks, so flags are tested once per
+	# distinct mask rather than once per province
+	counts = {name: 0 for name in TERRAIN_TYPES}
+	for mask, occurrences in Counter(masks).items():
+		for name, bit in TERRAIN_TYPES.items():
+			if mask & bit: counts[name] += occurrences
+	return counts
+
+class MapQuery:
+
+	def __init__(
+			self,
+			min_provinces = None,
+			max_provinces = None,
+			wraparound = None,
+			max_underwater = None,
+			text = None,
+			page = 1,
+			per_page = 25):
+		self.min_provinces = min_provinces
+		self.max_provinces = max_provinces
+		self.wraparound = wraparound
+		# percentage of underwater provinces, 0-100
+		self.max_underwater = max_underwater
+		# search is case and whitespace insensitive, so the text is kept in
+		# the one form every equivalent query shares
+		self.text = " ".join(text.lower().split()) or None if text else None
+		self.page = max(1, page)
+		self.per_page = max(1, per_page)
+
+	def key(self):
+		# equal for every query string that selects the same page
+		return (
+			self.min_provinces, self.max_provinces, self.wraparound, self.max_underwater,
+			self.text, self.page, self.per_page
+		)
+
+class MapIndex:
+
+	def __init__(self, maps):
+		# maps are kept sorted by title, so every candidate set can be turned
+		# back into a stable ordering by position alone
+		self.maps = sorted(maps, key = lambda m: m.title.lower())
+		self.by_provinces = sorted((m.provinces, n) for n, m in enumerate(self.maps))
+		self.by_underwater = sorted(
+			(100 * m.water_ratio, n) for n, m in enumerate(self.maps)
+		)
+		self.by_wraparound = {}
+		self.by_word = {}
+		for n, _map in enumerate(self.maps):
+			self.by_wraparound.setdefault(_map.wraparound, set()).add(n)
+			for word in re.findall(r"\w+", _map.title.lower()):
+				self.by_word.setdefault(word, set()).add(n)
+		self.words = sorted(self.by_word)
+
+	def _range(self, index, lower, upper):
+		start = 0 if lower is None else bisect_left(index, (lower, -1))
+		end = len(index) if upper is None else bisect_right(index, (upper, len(index)))
+		return {n for _, n in index[start:end]}
+
+	def _prefix(self, prefix):
+		matches = set()
+		start = bisect_left(self.words, prefix)
+		for word in self.words[start:]:
+			if not word.startswith(prefix): break
+			matches |= self.by_word[word]
+		return matches
+
+	def search(self, query):
+		candidates = []
+		if query.min_provinces is not None or query.max_provinces is not None:
+			candidates.append(self._range(
+				self.by_provinces, query.min_provinces, query.max_provinces
+			))
+		if query.max_underwater is not None:
+			candidates.append(self._range(self.by_underwater, None, query.max_underwater))
+		if query.wraparound:
+			candidates.append(self.by_wraparound.get(query.wraparound, set()))
+		if query.text:
+			for word in re.findall(r"\w+", query.text.lower()):
+				candidates.append(self._prefix(word))
+
+		if candidates:
+			candidates.sort(key = len)
+			matches = sorted(candidates[0].intersection(*candidates[1:]))
+		else:
+			matches = range(len(self.maps))
 
+		start = (query.page - 1) * query.per_page
+		page = [self.maps[n] for n in matches[start:start + query.per_page]]
+		return page, len(matches)
@@ -1,59 +1,77 @@
-from PIL import Image
 from pathlib import Path
+import mmap
+import re
 
+from .maps import save_thumbnail
 from .config.mods import MOD_ICON_DIR
 
+# everything else in a .dm file (monsters, spells, items...) is skipped by the
+# regex engine without ever being split into python strings
+DIRECTIVE_REGEX = re.compile(
+  rb"^#(modname|icon|version|domversion|description|selectnation|newnation"
+  rb"|name|epithet|era|end|new\w+|select\w+)\b[ \t]*([^\r\n]*)",
+  re.M
+)
+QUOTED_REGEX = re.compile(rb'"(.*?)"', re.S)
+
 class Dom5Mod:
 
-  def __init__(self, path_to_mod):
+  def __init__(self, path_to_mod, write_thumbnail = True):
     self.filename = path_to_mod.name
-    current_nation_id = None
-    modded_nations = {}
-
-    with open(path_to_mod, "r") as file:
-      line = file.readline()
-      eof = not line
-      while not eof:
-        if line.startswith("--"): pass
-        elif line.startswith("#"):
-          command, *args = line.split()
-
-          if command == "#modname": self.title = " ".join(args).replace("\"", "")
-          elif command == "#icon": self.icon = " ".join(args).replace("\"", "")
-          elif command == "#version": self.version = " ".join(args)
-          elif command == "#domversion": self.domversion = " ".join(args)
-          elif command == "#description":
-            self.description = [" ".join(args)]
-            while not line.endswith("\"\n"):
-              line = file.readline()
-              self.description.append(line)
-            self.description = "<br>".join(self.description)
-            self.description = self.description.replace("\n", "")
-            self.description = self.description.replace("\"", "")
-
-          elif command.startswith("#new"): current_nation_id = None
-
-          elif command == "#selectnation":
-            current_nation_id = int(args[0]) 
-            modded_nations[current_nation_id] = {}
-          elif command == "#name" and current_nation_id:
-            modded_nations[current_nation_id]["name"] = " ".join(args).replace("\"", "")
-          elif command == "#epithet" and current_nation_id: 
-            modded_nations[current_nation_id]["epithet"] = " ".join(args).replace("\"", "")
-
-        line = file.readline()
-        eof = not bool(line)
+    self.description = ""
+    self.nation_info = {}
+    current_nation = None
+
+    with open(path_to_mod, "rb") as file, \
+        mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as data:
+      for match in DIRECTIVE_REGEX.finditer(data):
+        command, args = match.group(1).decode(), decode(match.group(2))
+
+        if command == "modname": self.title = args.replace("\"", "")
+        elif command == "icon": self.icon = args.replace("\"", "")
+        elif command == "version": self.version = args
+        elif command == "domversion": self.domversion = args
+        elif command == "description":
+          quoted = QUOTED_REGEX.match(data, match.start(2))
+          if quoted:
+            lines = decode(quoted.group(1)).replace("\r", "").split("\n")
+            self.description = "<br>".join(lines)
+          else:
+            self.description = args.replace("\"", "")
+
+        elif command == "selectnation":
+          nation_id = int(args.split()[0])
+          current_nation = self.nation_info.setdefault(nation_id, {})
+        elif command in ("name", "epithet") and current_nation is not None:
+          current_nation[command] = args.replace("\"", "")
+        elif command == "era" and current_nation is not None:
+          current_nation["era"] = int(args.split()[0])
+        elif command == "end" or command.startswith(("new", "select")):
+          current_nation = None
+
     self.nations = {}
-    for nid, nation in modded_nations.items():
+    for nid, nation in self.nation_info.items():
       if nation.get("name"):
-        name = nation["name"]
-        if nation.get("epithet"):
-          epithet = nation.get("epithet")
-          name = f"{name}, {epithet}"
-        self.nations[nid] = name
-
-    with Image.open(path_to_mod.parent / self.icon) as im:
-      self.thumbnail = (self.title + ".thumbnail").replace(" ", "")
-      im.thumbnail((256, 256))
-      im = im.convert("RGB")
-      im.save(MOD_ICON_DIR / self.thumbnail, "JPEG")
+        self.nations[nid] = nation_title(nation)
+
+    self.thumbnail = (self.title + ".thumbnail").replace(" ", "")
+    if write_thumbnail:
+      save_thumbnail(path_to_mod.parent / self.icon, MOD_ICON_DIR, self.thumbnail)
+
+def decode(data):
+  return data.decode("utf-8", errors = "replace").strip()
+
+def nation_title(nation):
+  name = nation["name"]
+  if nation.get("epithet"):
+    epithet = nation.get("epithet")
+    name = f"{name}, {epithet}"
+  return name
+
+def scan_mods(paths, write_thumbnails = True):
+  # serial: the regex scan holds the gil, so threads bought nothing. an
+  # empty .dm can't be mapped and has nothing to read anyway
+  return [
+    Dom5Mod(path, write_thumbnail = write_thumbnails)
+    for path in paths if path.stat().st_size
+  ]
@@ -2,6 +2,7 @@ import json
 import requests
 
 from .config.notify import USER_AGENT
+from .profiling import timed
 
 class Notifier:
 
@@ -9,6 +10,8 @@ class Notifier:
 
   @classmethod
   def register_notifier(cls, notifier_cls):
+    # notifiers block the event loop while they post, so they get a span each
+    notifier_cls.notify = timed(f"notify.{notifier_cls.name}")(notifier_cls.notify)
     cls._notifiers[notifier_cls.name] = notifier_cls
     return notifier_cls
 
@@ -0,0 +1,148 @@
+import sys
+import time
+import asyncio
+import functools
+import threading
+from pathlib import Path
+from collections import Counter, deque
+
+from .snapshots import write_atomic
+from .config.profiling import (
+  PROFILE_ENABLED, PROFILE_SAMPLE_INTERVAL, PROFILE_SLOW_CALLBACK, PROFILE_DUMP_INTERVAL
+)
+
+def collapse(frame):
+  stack = []
+  while frame:
+    code = frame.f_code
+    stack.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+    frame = frame.f_back
+  return ";".join(reversed(stack))
+
+class Profiler:
+
+  def __init__(self, enabled = PROFILE_ENABLED):
+    self.enabled = enabled
+    # name -> [count, total seconds, max seconds]
+    self.spans = {}
+    self.stacks = Counter()
+    self.slow_callbacks = deque(maxlen = 100)
+    self.lock = threading.Lock()
+    self.started = None
+    self.thread = None
+    self.heartbeat_task = None
+    self.stopping = threading.Event()
+
+  def timed(self, name):
+    # decided once at import: with profiling off the function is returned
+    # untouched, so the hot paths pay nothing
+    def decorator(func):
+      if not self.enabled: return func
+      if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def timed_coroutine(*args, **kwargs):
+          start = time.perf_counter()
+          try:
+            return await func(*args, **kwargs)
+          finally:
+            self.record(name, time.perf_counter() - start)
+        return timed_coroutine
+
+      @functools.wraps(func)
+      def timed_function(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+          return func(*args, **kwargs)
+        finally:
+          self.record(name, time.perf_counter() - start)
+      return timed_function
+    return decorator
+
+  def record(self, name, elapsed):
+    span = self.spans.get(name)
+    if span is None:
+      self.spans[name] = [1, elapsed, elapsed]
+    else:
+      span[0] += 1
+      span[1] += elapsed
+      if elapsed > span[2]: span[2] = elapsed
+
+  def start(self, dump_path):
+    if not self.enabled or self.thread: return
+    self.dump_path = Path(dump_path)
+    self.started = time.time()
+    self.heartbeat = time.monotonic()
+    self.heartbeat_task = asyncio.create_task(self._beat())
+    self.thread = threading.Thread(
+      target = self._sample, args = (threading.get_ident(),),
+      name = "profiler", daemon = True
+    )
+    self.thread.start()
+
+  def stop(self):
+    if not self.thread: return
+    self.stopping.set()
+    self.thread.join()
+    self.thread = None
+    self.heartbeat_task.cancel()
+    self.dump()
+
+  async def _beat(self):
+    while True:
+      self.heartbeat = time.monotonic()
+      await asyncio.sleep(PROFILE_SAMPLE_INTERVAL)
+
+  def _sample(self, loop_thread):
+    # runs in its own thread, so it keeps sampling while a callback blocks
+    # the event loop; a heartbeat that stops moving is a slow callback
+    stall = None
+    next_dump = time.monotonic() + PROFILE_DUMP_INTERVAL
+    while not self.stopping.wait(PROFILE_SAMPLE_INTERVAL):
+      frame = sys._current_frames().get(loop_thread)
+      if frame is None: continue
+      stack = collapse(frame)
+      del frame
+      with self.lock:
+        self.stacks[stack] += 1
+
+      now = time.monotonic()
+      lag = now - self.heartbeat - PROFILE_SAMPLE_INTERVAL
+      if lag < PROFILE_SLOW_CALLBACK:
+        stall = None
+      elif stall is None:
+        stall = dict(at = time.time() - lag, seconds = lag, stack = stack)
+        with self.lock:
+          self.slow_callbacks.append(stall)
+      else:
+        stall["seconds"] = lag
+
+      if now >= next_dump:
+        self.dump()
+        next_dump = now + PROFILE_DUMP_INTERVAL
+
+  def folded(self):
+    with self.lock:
+      stacks = list(self.stacks.items())
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks))
+
+  def dump(self):
+    write_atomic(self.dump_path, self.folded().encode())
+
+  def report(self):
+    spans = sorted(self.spans.items(), key = lambda span: span[1][1], reverse = True)
+    with self.lock:
+      samples = sum(self.stacks.values())
+      slow_callbacks = [dict(stall) for stall in self.slow_callbacks]
+    return dict(
+      started = self.started,
+      samples = samples,
+      sample_interval = PROFILE_SAMPLE_INTERVAL,
+      spans = [
+        dict(name = name, count = count, total = total, mean = total / count, max = longest)
+        for name, (count, total, longest) in spans
+      ],
+      slow_callbacks = slow_callbacks
+    )
+
+profiler = Profiler()
+timed = profiler.timed
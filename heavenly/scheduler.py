@@ -0,0 +1,116 @@
+import re
+import time
+import heapq
+import asyncio
+import itertools
+
+from .config.scheduler import REMINDER_OFFSETS
+
+TIME_UNITS = {"day": 86400, "hour": 3600, "minute": 60, "second": 1}
+TIME_REGEX = re.compile(r"(\d+)\s*(day|hour|minute|second)s?")
+
+def parse_time_until_host(text):
+  if not text: return None
+  matches = TIME_REGEX.findall(text.lower())
+  if not matches: return None
+  return sum(int(amount) * TIME_UNITS[unit] for amount, unit in matches)
+
+class DeadlineScheduler:
+
+  def __init__(self, clock = time.monotonic):
+    self.clock = clock
+    self.heap = []
+    self.entries = {}
+    self.counter = itertools.count()
+    # made in run(): before 3.10 an Event binds to the loop current at
+    # construction, and hosts are built before asyncio.run starts theirs
+    self.wakeup = None
+
+  def schedule(self, key, when, callback):
+    # rescheduling a key only marks the old heap entry dead; it is dropped
+    # lazily when it reaches the top
+    self.cancel(key)
+    entry = [when, next(self.counter), key, callback]
+    self.entries[key] = entry
+    heapq.heappush(self.heap, entry)
+    if self.heap[0] is entry and self.wakeup: self.wakeup.set()
+
+  def cancel(self, key):
+    entry = self.entries.pop(key, None)
+    if entry: entry[3] = None
+
+  def cancel_prefix(self, prefix):
+    for key in [key for key in self.entries if key[:len(prefix)] == prefix]:
+      self.cancel(key)
+
+  def pop_due(self):
+    now = self.clock()
+    while self.heap and self.heap[0][0] <= now:
+      when, _, key, callback = heapq.heappop(self.heap)
+      if callback is None: continue
+      del self.entries[key]
+      yield key, callback
+
+  async def run(self):
+    self.wakeup = asyncio.Event()
+    while True:
+      for key, callback in self.pop_due():
+        try:
+          callback()
+        except Exception as error:
+          print(f"scheduled callback {key} failed: {error}")
+      while self.heap and self.heap[0][3] is None:
+        heapq.heappop(self.heap)
+      timeout = self.heap[0][0] - self.clock() if self.heap else None
+      self.wakeup.clear()
+      try:
+        await asyncio.wait_for(self.wakeup.wait(), timeout)
+      except asyncio.TimeoutError:
+        pass
+
+class TurnReminders:
+
+  def __init__(self, scheduler, offsets = REMINDER_OFFSETS):
+    self.scheduler = scheduler
+    self.offsets = sorted(offsets, reverse = True)
+    self.deadlines = {}
+
+  def update_deadline(self, game, seconds_left):
+    if seconds_left is None:
+      self.clear(game)
+      return
+    deadline = self.scheduler.clock() + seconds_left
+    previous = self.deadlines.get(game.name)
+    # dom5 reports whole minutes, so small drift is not a new deadline
+    if previous is not None and abs(previous - deadline) < 90: return
+    self.deadlines[game.name] = deadline
+    self.scheduler.cancel_prefix((game.name,))
+    for offset in self.offsets:
+      if offset < seconds_left:
+        self.scheduler.schedule(
+          (game.name, offset), deadline - offset,
+          lambda offset = offset: self.remind(game, offset)
+        )
+
+  def clear(self, game):
+    self.deadlines.pop(game.name, None)
+    self.scheduler.cancel_prefix((game.name,))
+
+  def remind(self, game, offset):
+    waiting = [
+      name for name, turn, *_ in game.player_status()
+      if turn not in ("played", "eliminated", "AI")
+    ]
+    if not waiting: return
+    game.notify(
+      "{} will host turn {} in {}. Still waiting for: {}".format(
+        game.name, game.turn, format_duration(offset), ", ".join(waiting)
+      )
+    )
+
+def format_duration(seconds):
+  parts = []
+  for unit, size in TIME_UNITS.items():
+    amount, seconds = divmod(seconds, size)
+    if amount: parts.append(f"{amount} {unit}{'s' if amount != 1 else ''}")
+  return " ".join(parts) or "0 seconds"
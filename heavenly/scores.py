@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import struct
+from array import array
+from bisect import bisect_left
+from html import unescape
+from pathlib import Path
+
+from .cache import LRUCache
+from .snapshots import write_atomic
+from .config.scores import SCORE_CACHE_GAMES
+
+# one sample: turn, nation index, metric index, value
+RECORD = struct.Struct("<HHHf")
+ROW_REGEX = re.compile(r"<tr[^>]*>(.*?)</tr>", re.S | re.I)
+CELL_REGEX = re.compile(r"<t[dh][^>]*>(.*?)</t[dh]>", re.S | re.I)
+TAG_REGEX = re.compile(r"<[^>]+>")
+NUMBER_REGEX = re.compile(r"^-?\d+(\.\d+)?$")
+
+def parse_scores(text):
+  # dom5 writes one row per nation under a header row naming the columns;
+  # columns that aren't numbers for every nation are not metrics
+  rows = [
+    [unescape(TAG_REGEX.sub("", cell)).strip() for cell in CELL_REGEX.findall(row)]
+    for row in ROW_REGEX.findall(text)
+  ]
+  rows = [row for row in rows if len(row) > 1]
+  if len(rows) < 2: return {}
+  header, rows = rows[0], rows[1:]
+  metrics = [
+    (column, name) for column, name in enumerate(header[1:], 1)
+    if all(column < len(row) and NUMBER_REGEX.match(row[column].replace(",", "")) for row in rows)
+  ]
+  return {
+    row[0]: {name: float(row[column].replace(",", "")) for column, name in metrics}
+    for row in rows
+  }
+
+def read_scores(game_path, since_mtime = None):
+  # blocking, meant to be run in an executor; dom5 rewrites scores.html
+  # every turn, so only the newest dump is ever read
+  score_path = game_path / "scores.html"
+  try:
+    mtime = score_path.stat().st_mtime
+    if mtime == since_mtime: return None
+    with open(score_path, "r", encoding = "utf-8", errors = "replace") as file:
+      return mtime, parse_scores(file.read())
+  except FileNotFoundError:
+    return None
+
+class ScoreSeries:
+
+  def __init__(self, nations, metrics, records):
+    self.nations = nations
+    self.metrics = metrics
+    # metric index -> nation index -> (turns, values)
+    self.columns = {}
+    self.turns = array("H")
+    self.mtime = None
+    self.records = 0
+    for turn, nation, metric, value in records: self.add(turn, nation, metric, value)
+
+  def add(self, turn, nation, metric, value):
+    turns, values = self.columns.setdefault(metric, {}).setdefault(
+      nation, (array("H"), array("f"))
+    )
+    turns.append(turn)
+    values.append(value)
+    # records are appended turn by turn, so both stay sorted
+    if not self.turns or self.turns[-1] < turn: self.turns.append(turn)
+
+  @property
+  def last_turn(self):
+    return self.turns[-1] if self.turns else 0
+
+  def sample(self, metric, points):
+    if not self.metrics: return dict(metric = None, metrics = [], turns = [], series = {})
+    if metric is None: metric = self.metrics[0]
+    if metric not in self.metrics: return None
+    columns = self.columns.get(self.metrics.index(metric), {})
+    picked = downsample(self.turns, points)
+    series = {}
+    for nation, (nation_turns, values) in columns.items():
+      samples = []
+      for turn in picked:
+        index = bisect_left(nation_turns, turn)
+        found = index < len(nation_turns) and nation_turns[index] == turn
+        samples.append(round(values[index], 2) if found else None)
+      series[self.nations[nation]] = samples
+    return dict(metric = metric, metrics = self.metrics, turns = picked, series = series)
+
+def downsample(turns, points):
+  # keeps the first and last turn and evenly spaced ones between them, so a
+  # chart costs the same on turn 20 as on turn 2000
+  if len(turns) <= points: return list(turns)
+  step = (len(turns) - 1) / (points - 1)
+  return [turns[round(n * step)] for n in range(points)]
+
+class ScoreStore:
+
+  def __init__(self, path):
+    self.path = Path(path)
+    self.path.mkdir(exist_ok = True)
+    self.loaded = LRUCache(SCORE_CACHE_GAMES)
+
+  def _header(self, name):
+    return self.path / f"{name}.json"
+
+  def _data(self, name):
+    return self.path / f"{name}.bin"
+
+  def version(self, name):
+    # the header is rewritten on every append, which also lets a web-only
+    # process notice what the supervisor ingested
+    try:
+      return self._header(name).stat().st_mtime_ns
+    except FileNotFoundError:
+      return 0
+
+  def load(self, name):
+    version = self.version(name)
+    cached = self.loaded.get(name)
+    if cached and cached[0] == version: return cached[1]
+    header = {"nations": [], "metrics": [], "records": 0}
+    data = b""
+    if version:
+      with open(self._header(name), "r") as file:
+        header = json.load(file)
+      with open(self._data(name), "rb") as file:
+        data = file.read(header["records"] * RECORD.size)
+    series = ScoreSeries(header["nations"], header["metrics"], RECORD.iter_unpack(data))
+    series.mtime = header.get("mtime")
+    series.records = header["records"]
+    self.loaded.put(name, (version, series))
+    return series
+
+  def last_mtime(self, name):
+    return self.load(name).mtime
+
+  def append(self, name, turn, mtime, scores):
+    series = self.load(name)
+    if turn <= series.last_turn:
+      self.truncate(name, turn - 1)
+      series = self.load(name)
+    records = bytearray()
+    added = 0
+    for nation, metrics in scores.items():
+      if nation not in series.nations: series.nations.append(nation)
+      for metric, value in metrics.items():
+        if metric not in series.metrics: series.metrics.append(metric)
+        record = (turn, series.nations.index(nation), series.metrics.index(metric), value)
+        series.add(*record)
+        records += RECORD.pack(*record)
+        added += 1
+
+    # the header is the commit point: data past the record count it names
+    # is left over from an interrupted append and gets overwritten
+    mode = "r+b" if self._data(name).exists() else "wb"
+    with open(self._data(name), mode) as file:
+      file.seek(series.records * RECORD.size)
+      file.write(records)
+      file.truncate()
+    series.mtime = mtime
+    series.records += added
+    self._write_header(name, series)
+    self.loaded.put(name, (self.version(name), series))
+
+  def truncate(self, name, last_turn):
+    # after a rollback the turns past it are replayed and ingested again
+    series = self.load(name)
+    kept = sorted(
+      (turn, nation, metric, value)
+      for metric, columns in series.columns.items()
+      for nation, (turns, values) in columns.items()
+      for turn, value in zip(turns, values) if turn <= last_turn
+    )
+    write_atomic(self._data(name), b"".join(RECORD.pack(*record) for record in kept))
+    series.records = len(kept)
+    self._write_header(name, series)
+    self.loaded.discard(name)
+
+  def _write_header(self, name, series):
+    header = dict(
+      nations = series.nations, metrics = series.metrics,
+      mtime = series.mtime, records = series.records
+    )
+    write_atomic(self._header(name), json.dumps(header).encode())
+
+  def sample(self, name, metric, points):
+    return self.load(name).sample(metric, points)
+
+  def discard(self, name):
+    self.loaded.discard(name)
+    for path in (self._header(name), self._data(name)):
+      if path.exists(): os.remove(path)
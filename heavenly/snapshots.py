@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import tempfile
+from hashlib import sha256
+from pathlib import Path
+
+SNAPSHOT_EXCLUDE = set(["domcmd", "domcmd.tmp", "host_data.json"])
+# objects touched this recently may belong to a snapshot whose manifest
+# isn't written yet, so prune leaves them alone
+PRUNE_GRACE = 15 * 60
+
+class SnapshotStore:
+
+  def __init__(self, path):
+    self.path = Path(path)
+    self.object_path = self.path / "objects"
+    self.object_path.mkdir(parents = True, exist_ok = True)
+
+  def _object(self, digest):
+    return self.object_path / digest[:2] / digest
+
+  def _manifest(self, name, turn):
+    return self.path / name / f"{turn}.json"
+
+  def turns(self, name):
+    game_path = self.path / name
+    if not game_path.exists(): return []
+    return sorted(int(path.stem) for path in game_path.glob("*.json"))
+
+  def snapshot(self, name, turn, game_path):
+    # blocking, meant to be run in an executor
+    manifest = {}
+    for file_path in sorted(game_path.iterdir()):
+      if not file_path.is_file() or file_path.name in SNAPSHOT_EXCLUDE:
+        continue
+      with open(file_path, "rb") as file:
+        data = file.read()
+      digest = sha256(data).hexdigest()
+      object_path = self._object(digest)
+      # content addressed: files unchanged since an earlier turn are
+      # already stored under the same digest
+      if object_path.exists():
+        os.utime(object_path)
+      else:
+        object_path.parent.mkdir(exist_ok = True)
+        write_atomic(object_path, data)
+      manifest[file_path.name] = digest
+
+    manifest_path = self._manifest(name, turn)
+    manifest_path.parent.mkdir(exist_ok = True)
+    write_atomic(manifest_path, json.dumps(manifest, indent = 2).encode())
+    return manifest
+
+  def restore(self, name, turn, game_path):
+    # blocking, meant to be run in an executor
+    with open(self._manifest(name, turn), "r") as file:
+      manifest = json.load(file)
+    for file_path in game_path.iterdir():
+      if (file_path.is_file() and file_path.name not in manifest
+          and file_path.name not in SNAPSHOT_EXCLUDE):
+        file_path.unlink()
+    for filename, digest in manifest.items():
+      with open(self._object(digest), "rb") as file:
+        write_atomic(game_path / filename, file.read())
+
+  def discard(self, name, after_turn):
+    for turn in self.turns(name):
+      if turn > after_turn: self._manifest(name, turn).unlink()
+
+  def prune(self):
+    referenced = set()
+    for manifest_path in self.path.glob("*/*.json"):
+      with open(manifest_path, "r") as file:
+        referenced.update(json.load(file).values())
+    cutoff = time.time() - PRUNE_GRACE
+    for object_path in self.object_path.glob("*/*"):
+      if object_path.name in referenced: continue
+      try:
+        if object_path.stat().st_mtime < cutoff: object_path.unlink()
+      except FileNotFoundError:
+        pass
+
+def write_atomic(path, data):
+  # a unique temp name: two writers of the same path (two games storing
+  # the same object) must not share one
+  fd, tmp_path = tempfile.mkstemp(dir = path.parent, prefix = path.name, suffix = ".tmp")
+  try:
+    with os.fdopen(fd, "wb") as file:
+      file.write(data)
+    os.replace(tmp_path, path)
+  except BaseException:
+    os.unlink(tmp_path)
+    raise
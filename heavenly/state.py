@@ -0,0 +1,234 @@
+import json
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+from .events import EventBroadcaster
+from .notify import Notifier
+from .config.state import STATE_FLUSH_INTERVAL, STATE_POLL_INTERVAL
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+  name TEXT PRIMARY KEY,
+  version INTEGER NOT NULL,
+  status TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS commands (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  op TEXT NOT NULL,
+  payload TEXT NOT NULL
+);
+"""
+
+class StateStore:
+
+  def __init__(self, path):
+    self.path = path
+    self.db = sqlite3.connect(str(path), isolation_level = None, check_same_thread = False)
+    # WAL lets any number of web workers read while the supervisor writes
+    self.db.execute("PRAGMA journal_mode = WAL")
+    self.db.execute("PRAGMA synchronous = NORMAL")
+    self.db.executescript(SCHEMA)
+
+  def write_games(self, rows, deleted = ()):
+    with self.db:
+      self.db.execute("BEGIN")
+      self.db.executemany(
+        "INSERT OR REPLACE INTO games (name, version, status) VALUES (?, ?, ?)",
+        [(name, version, json.dumps(status)) for name, version, status in rows]
+      )
+      self.db.executemany("DELETE FROM games WHERE name = ?", [(n,) for n in deleted])
+
+  def write_meta(self, **values):
+    with self.db:
+      self.db.execute("BEGIN")
+      self.db.executemany(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+        [(key, json.dumps(value)) for key, value in values.items()]
+      )
+
+  def read_meta(self):
+    rows = self.db.execute("SELECT key, value FROM meta")
+    return {key: json.loads(value) for key, value in rows}
+
+  def read_versions(self):
+    return dict(self.db.execute("SELECT name, version FROM games"))
+
+  def read_games(self, names):
+    marks = ",".join("?" * len(names))
+    rows = self.db.execute(
+      f"SELECT name, version, status FROM games WHERE name IN ({marks})", list(names)
+    )
+    return [(name, version, json.loads(status)) for name, version, status in rows]
+
+  def push_command(self, op, **payload):
+    self.db.execute(
+      "INSERT INTO commands (op, payload) VALUES (?, ?)", (op, json.dumps(payload))
+    )
+
+  def pop_commands(self):
+    with self.db:
+      self.db.execute("BEGIN IMMEDIATE")
+      rows = self.db.execute("SELECT id, op, payload FROM commands ORDER BY id").fetchall()
+      self.db.execute("DELETE FROM commands")
+    return [(op, json.loads(payload)) for _, op, payload in rows]
+
+class StatePublisher:
+
+  def __init__(self, host, store):
+    self.host = host
+    self.store = store
+    self.dirty = set(game.name for game in host.games)
+    self.dirty.update(host.archived_games)
+    self.nations_written = False
+    host.game_change_callbacks.append(self.on_game_change)
+
+  def on_game_change(self, game):
+    self.dirty.add(game.name)
+
+  def flush(self):
+    rows, deleted = [], []
+    for name in self.dirty:
+      game = self.host.find_game_by_name(name)
+      if game:
+        status = game.status()
+        status["thumbnail"] = game.map.thumbnail if game.map else None
+        rows.append((name, game.version, status))
+      elif name in self.host.archived_games:
+        rows.append((name, 0, self.host.archived_games[name].summary()))
+      else:
+        deleted.append(name)
+    self.dirty.clear()
+    self.store.write_games(rows, deleted)
+    meta = dict(epoch = self.host.epoch, version = self.host.version)
+    if not self.nations_written and getattr(self.host, "nations", None):
+      meta.update(nations = self.host.nations)
+      self.nations_written = True
+    self.store.write_meta(**meta)
+
+  def run_command(self, op, payload):
+    if op == "create_game":
+      settings = payload["settings"]
+      settings["port"] = settings.get("port") or self.host.get_free_port()
+      notifiers = [Notifier._from_dict(n) for n in payload["notifiers"]]
+      if not self.host.find_game_by_name(payload["name"]):
+        game = self.host.create_new_game(payload["name"], notifiers, **settings)
+        game.start()
+
+  async def run(self):
+    while True:
+      for op, payload in self.store.pop_commands():
+        self.run_command(op, payload)
+      if self.dirty: self.flush()
+      await asyncio.sleep(STATE_FLUSH_INTERVAL)
+
+class GameView:
+
+  def __init__(self, name):
+    self.name = name
+    self.version = None
+    self.events = EventBroadcaster()
+
+  def update(self, version, status):
+    self.version = version
+    self._status = status
+    self.state = status["state"]
+    self.turn = status["turn"]
+    self.finished = status["finished"]
+    self.connections = status.get("connections")
+    self.settings = dict(port = status["port"])
+    self.map = (SimpleNamespace(thumbnail = status["thumbnail"])
+                if status.get("thumbnail") else None)
+    self.events.publish("status", self.status())
+
+  def summary(self):
+    return {key: self._status[key] for key in ("name", "state", "turn", "finished", "port")}
+
+  def status(self):
+    status = dict(self._status)
+    status.pop("thumbnail", None)
+    return status
+
+  def player_status(self):
+    return [tuple(player) for player in self._status.get("players", [])]
+
+class StoreView:
+
+  readonly = True
+
+  def __init__(self, store, library_host):
+    self.store = store
+    # maps, mods and the archive are read from disk like any host does;
+    # only live game state comes from the store
+    self.library = library_host
+    self.events = EventBroadcaster()
+    self.game_views = {}
+    self.archived = {}
+    self.version = 0
+    self.epoch = 0
+    self.nations = {}
+
+  def __getattr__(self, name):
+    return getattr(self.library, name)
+
+  def refresh(self):
+    meta = self.store.read_meta()
+    epoch = meta.get("epoch", 0)
+    if epoch != self.epoch:
+      # versions restart with the supervisor, so every game is read again
+      for view in self.game_views.values(): view.version = None
+    self.epoch, self.version = epoch, meta.get("version", 0)
+    if not self.nations and meta.get("nations"):
+      self.nations = {int(era): {int(nid): name for nid, name in nations.items()}
+                      for era, nations in meta["nations"].items()}
+
+    # the meta version only moves with game summaries; connections, players
+    # and submissions only show up in the per game versions
+    versions = self.store.read_versions()
+    for name in set(self.game_views) - set(versions):
+      del self.game_views[name]
+    # archived rows are written with version 0; anything else under an
+    # archived name means the game was restored
+    changed = [name for name, version in versions.items()
+               if (name not in self.archived or version != 0) and (name not in self.game_views
+                   or self.game_views[name].version != version)]
+    for name, version, status in self.store.read_games(changed) if changed else []:
+      if status.get("archived"):
+        self.game_views.pop(name, None)
+        if name not in self.archived:
+          self.library.archived_games = self.library.archive.load()
+        self.archived[name] = status
+        continue
+      if self.archived.pop(name, None):
+        self.library.archived_games = self.library.archive.load()
+      view = self.game_views.setdefault(name, GameView(name))
+      view.update(version, status)
+      self.events.publish("game", view.summary())
+
+  async def run(self):
+    while True:
+      self.refresh()
+      await asyncio.sleep(STATE_POLL_INTERVAL)
+
+  def game_summaries(self):
+    summaries = [view.summary() for view in self.game_views.values()]
+    summaries.extend(self.archived.values())
+    return summaries
+
+  def find_game_by_name(self, name):
+    return self.game_views.get(name)
+
+  def get_free_port(self):
+    # the supervisor assigns ports when it creates the game
+    return None
+
+  def request_new_game(self, name, notifiers, settings):
+    notifiers = [notifier._as_dict() for notifier in notifiers or ()]
+    self.store.push_command("create_game", name = name, settings = settings, notifiers = notifiers)
+
+  def shutdown(self):
+    pass
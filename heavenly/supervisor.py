@@ -0,0 +1,23 @@
+import asyncio
+
+from .host import Host
+from .state import StateStore, StatePublisher
+from .config.app import HOST_ROOT_PATH, HOST_PORT_RANGE
+from .config.state import STATE_DB_PATH
+
+async def supervise(host, publisher):
+  await host.startup()
+  await publisher.run()
+
+def main():
+  host = Host(HOST_ROOT_PATH, port_range = HOST_PORT_RANGE)
+  host.restore_games()
+  publisher = StatePublisher(host, StateStore(STATE_DB_PATH))
+  try:
+    asyncio.run(supervise(host, publisher))
+  finally:
+    host.shutdown()
+    publisher.flush()
+
+if __name__ == "__main__":
+  main()
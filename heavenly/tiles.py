@@ -0,0 +1,207 @@
+import os
+import math
+import tempfile
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+from .cache import ByteLRUCache
+from .config.maps import MAP_TILE_DIR, MAP_TILE_SIZE, MAP_TILE_CACHE_BYTES, MAP_TILE_SOURCE_CACHE_BYTES
+
+TILE_VARIANTS = ("summer", "winter")
+
+class TilePyramid:
+
+  def __init__(self, source_path, tile_dir, tile_size = MAP_TILE_SIZE):
+    self.source_path = source_path
+    self.tile_dir = tile_dir
+    self.tile_size = tile_size
+    # only the header is read here; pixel data is decoded on the first tile
+    with Image.open(source_path) as im:
+      self.width, self.height = im.size
+    self.max_level = math.ceil(math.log2(max(self.width, self.height, 1)))
+
+  def level_size(self, level):
+    scale = 2 ** (level - self.max_level)
+    return (max(1, math.ceil(self.width * scale)),
+            max(1, math.ceil(self.height * scale)))
+
+  def has_tile(self, level, col, row):
+    if not 0 <= level <= self.max_level: return False
+    width, height = self.level_size(level)
+    return (0 <= col < math.ceil(width / self.tile_size)
+            and 0 <= row < math.ceil(height / self.tile_size))
+
+  def tile_path(self, level, col, row):
+    return self.tile_dir / str(level) / f"{col}_{row}.jpg"
+
+  def render_tile(self, source, level, col, row):
+    width, height = self.level_size(level)
+    scale = 2 ** (self.max_level - level)
+    left, top = col * self.tile_size, row * self.tile_size
+    right = min(left + self.tile_size, width)
+    bottom = min(top + self.tile_size, height)
+    box = (left * scale, top * scale,
+           min(right * scale, self.width), min(bottom * scale, self.height))
+    tile = source.resize((right - left, bottom - top), box = box)
+
+    path = self.tile_path(level, col, row)
+    path.parent.mkdir(parents = True, exist_ok = True)
+    # a unique temp file, so a concurrent render of the same tile (from
+    # another process sharing the directory) can't replace it half written
+    fd, tmp_path = tempfile.mkstemp(dir = path.parent, suffix = ".tmp")
+    try:
+      with os.fdopen(fd, "wb") as file:
+        tile.save(file, "JPEG", quality = 85)
+      os.replace(tmp_path, path)
+    except BaseException:
+      os.unlink(tmp_path)
+      raise
+    return path
+
+  def as_dict(self):
+    return dict(
+      width = self.width,
+      height = self.height,
+      tile_size = self.tile_size,
+      max_level = self.max_level
+    )
+
+class TileCache:
+
+  def __init__(
+      self,
+      root = MAP_TILE_DIR,
+      maxbytes = MAP_TILE_CACHE_BYTES,
+      source_maxbytes = MAP_TILE_SOURCE_CACHE_BYTES,
+      managed = True):
+    self.root = root
+    self.maxbytes = maxbytes
+    # only one process may own the directory's size accounting; the others
+    # render into it and leave eviction to the owner's rescan
+    self.managed = managed
+    self.pyramids = {}
+    self.sources = ByteLRUCache(
+      maxbytes = source_maxbytes,
+      sizeof = lambda im: im.width * im.height * len(im.getbands())
+    )
+    self.lock = threading.Lock()
+    # path -> lock held while that tile renders, so concurrent requests
+    # for it wait for one render instead of starting their own
+    self.rendering = {}
+    # source path -> lock held while that image decodes
+    self.decoding = {}
+
+    self.size = 0
+    self.files = OrderedDict()
+    if managed: self.rescan()
+
+  def rescan(self):
+    # blocking; picks up tiles rendered by other processes sharing the root
+    existing = []
+    for path in self.root.rglob("*.jpg"):
+      try:
+        stat = path.stat()
+      except FileNotFoundError:
+        continue
+      existing.append((stat.st_mtime, path, stat.st_size))
+    existing.sort()
+    with self.lock:
+      current = set(path for _, path, _ in existing)
+      for path in [path for path in self.files if path not in current]:
+        self.size -= self.files.pop(path)
+      # tiles this process didn't render go in front of the ones it has
+      # served, oldest first
+      for _, path, size in reversed(existing):
+        if path not in self.files:
+          self.files[path] = size
+          self.size += size
+          self.files.move_to_end(path, last = False)
+      self.evict()
+
+  def cached_pyramid(self, dom5map, variant = "summer"):
+    return self.pyramids.get((dom5map.filename, variant))
+
+  def pyramid(self, dom5map, variant = "summer"):
+    # blocking the first time (it reads the image header), meant to be run
+    # in an executor unless cached_pyramid already has it
+    key = (dom5map.filename, variant)
+    if key not in self.pyramids:
+      image = dom5map.winter_tga if variant == "winter" else dom5map.tga
+      if not image: return None
+      source_path = dom5map.path.parent / image
+      # tiles of a replaced image live in another directory and age out
+      version = source_path.stat().st_mtime_ns
+      self.pyramids[key] = TilePyramid(
+        source_path, self.root / dom5map.path.stem / f"{variant}-{version:x}"
+      )
+    return self.pyramids[key]
+
+  def reset(self):
+    # after a library rescan: pyramids and decoded images may be stale
+    with self.lock:
+      self.pyramids = {}
+      self.sources.clear()
+
+  def source(self, pyramid):
+    # blocking; a decode only holds its own image's lock, so requests for
+    # other maps and cached tiles never wait behind it
+    key = str(pyramid.source_path)
+    with self.lock:
+      source = self.sources.get(key)
+      if source is not None: return source
+      decode_lock = self.decoding.setdefault(key, threading.Lock())
+    with decode_lock:
+      with self.lock:
+        source = self.sources.get(key)
+      if source is None:
+        with Image.open(pyramid.source_path) as im:
+          source = im.convert("RGB")
+        with self.lock:
+          self.sources.put(key, source)
+          self.decoding.pop(key, None)
+    return source
+
+  def get_tile(self, pyramid, level, col, row):
+    # blocking, meant to be run in an executor; returns the tile's bytes.
+    # the file is opened under the lock, so an eviction right after can
+    # only unlink it, not take it away from this read
+    path = pyramid.tile_path(level, col, row)
+    with self.lock:
+      file = self._open(path)
+      if file is None: render_lock = self.rendering.setdefault(path, threading.Lock())
+    if file is None:
+      with render_lock:
+        with self.lock:
+          file = self._open(path)
+        if file is None:
+          pyramid.render_tile(self.source(pyramid), level, col, row)
+          with self.lock:
+            self.rendering.pop(path, None)
+            file = open(path, "rb")
+            if self.managed:
+              self.files[path] = os.fstat(file.fileno()).st_size
+              self.size += self.files[path]
+              self.evict()
+    with file:
+      return file.read()
+
+  def _open(self, path):
+    if self.managed:
+      if path not in self.files: return None
+      self.files.move_to_end(path)
+    try:
+      return open(path, "rb")
+    except FileNotFoundError:
+      # removed behind our back: render it again
+      if path in self.files: self.size -= self.files.pop(path)
+      return None
+
+  def evict(self):
+    while self.size > self.maxbytes and self.files:
+      path, size = self.files.popitem(last = False)
+      self.size -= size
+      try:
+        path.unlink()
+      except FileNotFoundError:
+        pass
@@ -0,0 +1,111 @@
+import os
+import time
+import struct
+import ctypes
+import ctypes.util
+import asyncio
+
+from .config.watch import WATCH_POLL_INTERVAL
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct("iIII")
+
+WATCHED_SUFFIXES = (".2h", ".trn")
+
+def load_inotify():
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno = True)
+    libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+  except (OSError, AttributeError):
+    return None
+  libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+  libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+  return libc
+
+class TurnFileWatcher:
+
+  def __init__(self):
+    self.games = {}
+    self.fd = None
+    self.libc = load_inotify()
+    self.poll_task = None
+    self.loop = None
+    self.mtimes = {}
+
+  def start(self):
+    if self.libc:
+      fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+      if fd >= 0:
+        self.fd = fd
+        # close() may run after asyncio.run has returned, so it needs the
+        # loop the reader was added to rather than whatever is current then
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(fd, self._read_events)
+        return
+    # no inotify (not linux, or out of instances): fall back to polling
+    self.poll_task = asyncio.create_task(self._poll())
+
+  def close(self):
+    if self.fd is not None:
+      self.loop.remove_reader(self.fd)
+      os.close(self.fd)
+      self.fd = None
+    if self.poll_task: self.poll_task.cancel()
+
+  def watch(self, game):
+    if self.fd is not None:
+      wd = self.libc.inotify_add_watch(
+        self.fd, bytes(game.path), IN_CLOSE_WRITE | IN_MOVED_TO
+      )
+      if wd < 0: return False
+      self.games[wd] = game
+    else:
+      self.games[game.path] = game
+      self.mtimes[game.path] = self._scan(game.path)
+    return True
+
+  def unwatch(self, game):
+    for key, watched in list(self.games.items()):
+      if watched is game:
+        del self.games[key]
+        if self.fd is not None: self.libc.inotify_rm_watch(self.fd, key)
+        self.mtimes.pop(key, None)
+
+  def _read_events(self):
+    try:
+      data = os.read(self.fd, 64 * 1024)
+    except BlockingIOError:
+      return
+    offset = 0
+    now = time.time()
+    while offset < len(data):
+      wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+      offset += EVENT_HEADER.size
+      name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", "replace")
+      offset += length
+      game = self.games.get(wd)
+      if game and name.endswith(WATCHED_SUFFIXES):
+        game.on_turn_file(name, now)
+
+  def _scan(self, path):
+    mtimes = {}
+    try:
+      for entry in os.scandir(path):
+        if entry.name.endswith(WATCHED_SUFFIXES):
+          mtimes[entry.name] = entry.stat().st_mtime
+    except FileNotFoundError:
+      pass
+    return mtimes
+
+  async def _poll(self):
+    while True:
+      await asyncio.sleep(WATCH_POLL_INTERVAL)
+      for path, game in list(self.games.items()):
+        current = self._scan(path)
+        previous = self.mtimes.get(path, {})
+        for name, mtime in current.items():
+          if previous.get(name) != mtime: game.on_turn_file(name, mtime)
+        self.mtimes[path] = current
@@ -0,0 +1,21 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# the fake server stands in for dom5 wherever a test needs one
+os.environ.setdefault("DOM5_PATH", str(ROOT / "bench" / "fake_dom5"))
+
+@pytest.fixture
+def host(tmp_path):
+  from heavenly.host import Host
+  return Host(tmp_path / "host", port_range = (21600, 21700))
+
+@pytest.fixture
+def client(host):
+  import app as web
+  web.app.config.update(host_instance = host)
+  return web.app.test_client()
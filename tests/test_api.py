@@ -0,0 +1,41 @@
+import pytest
+
+@pytest.mark.asyncio
+async def test_game_status_is_not_modified_until_it_changes(host, client):
+  game = host.create_new_game("etag", port = 21600)
+  response = await client.get("/api/v1/games/etag")
+  etag = response.headers["ETag"]
+  assert (await response.get_json())["name"] == "etag"
+
+  response = await client.get("/api/v1/games/etag", headers = {"If-None-Match": etag})
+  assert response.status_code == 304
+  assert response.headers["ETag"] == etag
+
+  game.publish_status()
+  response = await client.get("/api/v1/games/etag", headers = {"If-None-Match": etag})
+  assert response.status_code == 200
+  assert response.headers["ETag"] != etag
+
+@pytest.mark.asyncio
+async def test_recreated_game_never_matches_an_old_etag(host, client):
+  game = host.create_new_game("again", port = 21600)
+  game.publish_status()
+  etag = (await client.get("/api/v1/games/again")).headers["ETag"]
+
+  host.games.remove(game)
+  host.create_new_game("again", port = 21601)
+  response = await client.get("/api/v1/games/again", headers = {"If-None-Match": etag})
+  assert response.status_code == 200
+  assert (await response.get_json())["port"] == 21601
+
+@pytest.mark.asyncio
+async def test_game_list_etag_follows_summaries(host, client):
+  response = await client.get("/api/v1/games")
+  etag = response.headers["ETag"]
+  response = await client.get("/api/v1/games", headers = {"If-None-Match": etag})
+  assert response.status_code == 304
+
+  host.create_new_game("listed", port = 21600)
+  response = await client.get("/api/v1/games", headers = {"If-None-Match": etag})
+  assert response.status_code == 200
+  assert [game["name"] for game in (await response.get_json())["games"]] == ["listed"]
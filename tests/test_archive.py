@@ -0,0 +1,58 @@
+import pytest
+
+from heavenly.archive import GameArchive
+
+def save_files(game):
+  game.path.mkdir(exist_ok = True)
+  (game.path / "ftherlnd").write_bytes(b"world" * 1000)
+  (game.path / "early_ulm.trn").write_bytes(b"turn")
+  (game.path / "maps").mkdir()
+  (game.path / "maps" / "custom.map").write_text("#dom2title Custom\n")
+
+def test_pack_removes_the_directory_and_extract_restores_it(host, tmp_path):
+  game = host.create_new_game("packed", port = 21600)
+  save_files(game)
+  archive = GameArchive(tmp_path / "archive")
+
+  archived = archive.pack(game)
+  assert not game.path.exists()
+  assert archived.verify()
+  assert sorted(archived.files()) == ["early_ulm.trn", "ftherlnd", "maps/custom.map"]
+  assert archived.read("early_ulm.trn") == b"turn"
+
+  archive.save_index({"packed": archived})
+  loaded = archive.load()["packed"]
+  assert loaded.archive_path == archived.archive_path and loaded.finished
+
+  loaded.extract(game.path)
+  assert (game.path / "ftherlnd").read_bytes() == b"world" * 1000
+  assert (game.path / "maps" / "custom.map").exists()
+
+def test_corrupt_archive_fails_verification(host, tmp_path):
+  game = host.create_new_game("corrupt", port = 21600)
+  save_files(game)
+  archived = GameArchive(tmp_path / "archive").pack(game)
+  data = bytearray(archived.archive_path.read_bytes())
+  data[len(data) // 3] ^= 0xff
+  archived.archive_path.write_bytes(bytes(data))
+  assert not archived.verify()
+
+@pytest.mark.asyncio
+async def test_only_finished_games_are_archived_and_restored(host):
+  running = host.create_new_game("running", port = 21600)
+  save_files(running)
+  assert await host.archive_game(running) is None
+  assert running in host.games and running.path.exists()
+
+  finished = host.create_new_game("finished", port = 21601)
+  save_files(finished)
+  finished.finished = True
+  assert await host.archive_finished() == ["finished"]
+  assert not finished.path.exists()
+  assert "finished" in host.archived_games and finished not in host.games
+
+  restored = await host.unarchive_game("finished")
+  assert restored.name == "finished" and restored.finished
+  assert (restored.path / "early_ulm.trn").read_bytes() == b"turn"
+  assert "finished" not in host.archived_games
+  assert not (host.archive_path / "finished.zip").exists()
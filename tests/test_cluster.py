@@ -0,0 +1,40 @@
+import json
+import time
+import hmac
+from hashlib import sha256
+
+import pytest
+
+from heavenly.cluster import ClusterError, RequestVerifier, cluster_key, sign_request
+from heavenly.config.cluster import CLUSTER_MAX_SKEW
+
+KEY = cluster_key("test secret")
+
+def test_signed_request_is_accepted_once():
+  verifier = RequestVerifier(KEY)
+  message = sign_request(KEY, dict(op = "status"))
+  assert verifier.verify(message) == dict(op = "status")
+  with pytest.raises(ClusterError, match = "replayed"):
+    verifier.verify(message)
+
+def test_fresh_requests_with_the_same_body_are_distinct():
+  verifier = RequestVerifier(KEY)
+  for _ in range(3):
+    assert verifier.verify(sign_request(KEY, dict(op = "status"))) == dict(op = "status")
+
+def test_stale_request_is_rejected():
+  body = json.dumps(dict(op = "status", ts = time.time() - 2 * CLUSTER_MAX_SKEW, nonce = "n"))
+  message = dict(body = body, mac = hmac.new(KEY, body.encode("utf-8"), sha256).hexdigest())
+  with pytest.raises(ClusterError, match = "stale"):
+    RequestVerifier(KEY).verify(message)
+
+def test_unsigned_or_forged_requests_are_rejected():
+  verifier = RequestVerifier(KEY)
+  with pytest.raises(ClusterError, match = "unsigned"):
+    verifier.verify(dict(op = "status"))
+  with pytest.raises(ClusterError, match = "bad signature"):
+    verifier.verify(sign_request(cluster_key("other secret"), dict(op = "status")))
+  message = sign_request(KEY, dict(op = "status"))
+  message["body"] = message["body"].replace("status", "export_game")
+  with pytest.raises(ClusterError, match = "bad signature"):
+    verifier.verify(message)
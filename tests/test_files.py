@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+import app as web
+from app import parse_byte_range
+
+def test_parse_byte_range():
+  assert parse_byte_range(None, 100) is None
+  assert parse_byte_range("bytes=-", 100) is None
+  assert parse_byte_range("items=0-10", 100) is None
+  assert parse_byte_range("bytes=0-9", 100) == (0, 9)
+  assert parse_byte_range("bytes=90-", 100) == (90, 99)
+  assert parse_byte_range("bytes=90-500", 100) == (90, 99)
+  assert parse_byte_range("bytes=-10", 100) == (90, 99)
+  assert parse_byte_range("bytes=-500", 100) == (0, 99)
+  assert parse_byte_range("bytes=100-", 100) == "unsatisfiable"
+  assert parse_byte_range("bytes=9-0", 100) == "unsatisfiable"
+
+@pytest.fixture
+def game(host):
+  return host.create_new_game("files", port = 21600)
+
+@pytest.mark.asyncio
+async def test_download_honours_range_and_etag(game, client):
+  (game.path / "early_ulm.trn").write_bytes(bytes(range(100)))
+  url = f"/games/files/{web.passcode(game)}/files/early_ulm.trn"
+
+  response = await client.get(url, headers = {"Range": "bytes=10-19"})
+  assert response.status_code == 206
+  assert response.headers["Content-Range"] == "bytes 10-19/100"
+  assert await response.get_data() == bytes(range(10, 20))
+
+  etag = response.headers["ETag"].strip('"')
+  response = await client.get(url, headers = {"If-None-Match": f'"{etag}"'})
+  assert response.status_code == 304
+
+  response = await client.get(url, headers = {"Range": "bytes=10-19", "If-Range": '"stale"'})
+  assert response.status_code == 200
+  assert await response.get_data() == bytes(range(100))
+
+  response = await client.get(url, headers = {"Range": "bytes=200-"})
+  assert response.status_code == 416
+
+@pytest.mark.asyncio
+async def test_concurrent_uploads_never_mix(game, client):
+  url = f"/games/files/{web.passcode(game)}/files/early_ulm.2h"
+  responses = await asyncio.gather(*(
+    client.put(url, data = bytes([65 + n]) * 200000) for n in range(4)
+  ))
+  assert [response.status_code for response in responses] == [201] * 4
+  # whichever upload landed last, it landed whole and left no temp files
+  assert len(set((game.path / "early_ulm.2h").read_bytes())) == 1
+  assert [path.name for path in game.path.iterdir()] == ["early_ulm.2h"]
+
+@pytest.mark.asyncio
+async def test_nation_passcode_only_opens_its_own_files(game, client):
+  (game.path / "early_ulm.trn").write_bytes(b"ulm")
+  (game.path / "early_arco.trn").write_bytes(b"arco")
+  code = web.nation_passcode(game, "early_ulm")
+  response = await client.get(f"/games/files/{code}/files/early_ulm.trn")
+  assert await response.get_data() == b"ulm"
+  response = await client.get(f"/games/files/{code}/files/early_arco.trn")
+  assert await response.get_data() != b"arco"
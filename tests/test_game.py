@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+def roster(game, *who_played):
+  game.players = [
+    dict(name = name, shortname = short, number = n, eliminated = False)
+    for n, (name, short, _) in enumerate(who_played)
+  ]
+  game.__dict__["who_played"] = [(short, turn, False) for _, short, turn in who_played]
+
+def test_submitted_orders_show_as_played_unless_dom5_says_unfinished(host):
+  game = host.create_new_game("status", port = 21600)
+  roster(game, ("Ulm", "Ulm", "-"), ("Arcoscephale", "Arco", "unfinished"), ("Ermor", "Ermor", "-"))
+  game.on_turn_file("early_ulm.2h", 10.0)
+  game.on_turn_file("early_arcoscephale.2h", 11.0)
+  assert [(name, turn) for name, turn, *_ in game.player_status()] == [
+    ("Ulm", "played"), ("Arcoscephale", "unfinished"), ("Ermor", "-")
+  ]
+
+@pytest.mark.asyncio
+async def test_commands_queued_in_one_tick_share_a_domcmd(host):
+  game = host.create_new_game("batched", port = 21600)
+  first, second = game.queue_command("settimeleft 60"), game.queue_command("setinterval 5")
+  await asyncio.sleep(0)
+  assert (game.path / "domcmd").read_text() == "settimeleft 60\nsetinterval 5\n"
+
+  # dom5 deletes the file once it has read it
+  (game.path / "domcmd").unlink()
+  game.flush_commands()
+  assert first.result() is True and second.result() is True
+
+@pytest.mark.asyncio
+async def test_stopping_removes_an_unread_domcmd(host):
+  game = host.create_new_game("cancelled", port = 21600)
+  sent = game.queue_command("settimeleft 60")
+  await asyncio.sleep(0)
+  queued = game.queue_command("setinterval 5")
+  await game.stop()
+  assert not (game.path / "domcmd").exists()
+  assert sent.cancelled() and queued.cancelled()
@@ -0,0 +1,60 @@
+from heavenly.maps import Dom5Map, MapIndex, MapQuery, TERRAIN_TYPES
+
+SEA = TERRAIN_TYPES["sea"]
+FOREST = TERRAIN_TYPES["forest"]
+
+def write_map(path, title, terrains, neighbours = (), extra = ""):
+  lines = [f"#dom2title {title}", f"#imagefile {path.stem}.tga"]
+  lines += [f"#terrain {n} {mask}" for n, mask in enumerate(terrains, 1)]
+  lines += [f"#neighbour {a} {b}" for a, b in neighbours]
+  path.write_text("\n".join(lines) + "\n" + extra)
+  return Dom5Map(path, write_thumbnail = False)
+
+def test_parses_directives_and_terrain(tmp_path):
+  _map = write_map(
+    tmp_path / "isles.map", "The   Isles", [0, SEA, SEA | FOREST, FOREST],
+    extra = '#hwraparound\n#winterimagefile isles_winter.tga\n#description "two\nlines"\n'
+  )
+  assert _map.title == "The Isles"
+  assert _map.tga == "isles.tga" and _map.winter_tga == "isles_winter.tga"
+  assert _map.wraparound == "Horizontal"
+  assert _map.description == "two<br>lines"
+  assert _map.provinces == 4 and _map.underwater == 2
+  assert _map.water_ratio == 0.5
+  assert _map.terrain_counts["forest"] == 2 and _map.terrain_counts["sea"] == 2
+
+def test_builds_a_symmetric_province_graph(tmp_path):
+  _map = write_map(
+    tmp_path / "ring.map", "Ring", [0, 0, 0, 0],
+    # duplicates, both directions and self loops collapse
+    neighbours = [(1, 2), (2, 1), (2, 3), (3, 4), (4, 1), (1, 2), (3, 3)]
+  )
+  assert list(_map.neighbours(1)) == [2, 4]
+  assert list(_map.neighbours(3)) == [2, 4]
+  assert [_map.degree(p) for p in range(1, 5)] == [2, 2, 2, 2]
+  assert _map.average_degree == 2.0
+
+def test_index_filters_and_pages(tmp_path):
+  maps = [
+    write_map(tmp_path / "a.map", "Alpha Lands", [0] * 10),
+    write_map(tmp_path / "b.map", "Beta Seas", [SEA] * 5 + [0] * 5),
+    write_map(tmp_path / "c.map", "Alpine Rings", [0] * 30, extra = "#wraparound\n"),
+  ]
+  index = MapIndex(maps)
+
+  def titles(**query):
+    found, total = index.search(MapQuery(**query))
+    return [_map.title for _map in found], total
+
+  assert titles() == (["Alpha Lands", "Alpine Rings", "Beta Seas"], 3)
+  assert titles(text = "alp") == (["Alpha Lands", "Alpine Rings"], 2)
+  assert titles(text = "  ALP   rings ") == (["Alpine Rings"], 1)
+  assert titles(min_provinces = 20) == (["Alpine Rings"], 1)
+  assert titles(max_underwater = 10) == (["Alpha Lands", "Alpine Rings"], 2)
+  assert titles(wraparound = "Full") == (["Alpine Rings"], 1)
+  assert titles(page = 2, per_page = 2) == (["Beta Seas"], 3)
+
+def test_equivalent_queries_share_a_key():
+  assert MapQuery(text = "  Foo  BAR").key() == MapQuery(text = "foo bar").key()
+  assert MapQuery(text = "   ").text is None
+  assert MapQuery(page = 1).key() != MapQuery(page = 2).key()
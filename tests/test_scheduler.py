@@ -0,0 +1,100 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from heavenly.scheduler import DeadlineScheduler, TurnReminders, parse_time_until_host
+
+class Clock:
+
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+def test_parse_time_until_host():
+  assert parse_time_until_host("2 days 3 hours") == 2 * 86400 + 3 * 3600
+  assert parse_time_until_host("1 minute") == 60
+  assert parse_time_until_host("") is None
+  assert parse_time_until_host("soon") is None
+
+def test_due_callbacks_pop_in_deadline_order():
+  clock = Clock()
+  scheduler = DeadlineScheduler(clock)
+  scheduler.schedule("late", clock.now + 20, lambda: None)
+  scheduler.schedule("early", clock.now + 10, lambda: None)
+  scheduler.schedule("cancelled", clock.now + 5, lambda: None)
+  scheduler.cancel("cancelled")
+  assert [key for key, _ in scheduler.pop_due()] == []
+  clock.now += 30
+  assert [key for key, _ in scheduler.pop_due()] == ["early", "late"]
+
+def test_rescheduling_replaces_the_earlier_deadline():
+  clock = Clock()
+  scheduler = DeadlineScheduler(clock)
+  scheduler.schedule("turn", clock.now + 10, lambda: None)
+  scheduler.schedule("turn", clock.now + 50, lambda: None)
+  clock.now += 20
+  assert list(scheduler.pop_due()) == []
+  clock.now += 40
+  assert [key for key, _ in scheduler.pop_due()] == ["turn"]
+
+def test_scheduler_made_outside_a_loop_runs_inside_one():
+  scheduler = DeadlineScheduler()
+  fired = []
+
+  async def main():
+    task = asyncio.create_task(scheduler.run())
+    await asyncio.sleep(0)
+    scheduler.schedule("now", time.monotonic(), lambda: fired.append(True))
+    await asyncio.sleep(0.05)
+    task.cancel()
+
+  asyncio.run(main())
+  assert fired == [True]
+
+def stub_game(name, players):
+  game = SimpleNamespace(name = name, turn = 3, messages = [])
+  game.player_status = lambda: players
+  game.notify = game.messages.append
+  return game
+
+def test_reminders_cover_offsets_before_the_deadline():
+  clock = Clock()
+  scheduler = DeadlineScheduler(clock)
+  reminders = TurnReminders(scheduler, offsets = (3600, 600))
+  game = stub_game("g", [])
+
+  reminders.update_deadline(game, 1800)
+  assert sorted(scheduler.entries) == [("g", 600)]
+  # dom5 reports whole minutes, so a slightly different deadline is the same one
+  reminders.update_deadline(game, 1790)
+  assert scheduler.entries[("g", 600)][0] == clock.now + 1800 - 600
+
+  reminders.update_deadline(game, 7200)
+  assert sorted(scheduler.entries) == [("g", 600), ("g", 3600)]
+  reminders.clear(game)
+  assert scheduler.entries == {} and reminders.deadlines == {}
+
+def test_remind_names_players_still_to_play():
+  reminders = TurnReminders(DeadlineScheduler(Clock()))
+  game = stub_game("g", [
+    ("Ulm", "played", True, None),
+    ("Arco", "unfinished", False, None),
+    ("Ermor", "-", False, None),
+    ("Pangaea", "eliminated", False, None),
+    ("Mictlan", "AI", False, None),
+  ])
+  reminders.remind(game, 3600)
+  assert game.messages == ["g will host turn 3 in 1 hour. Still waiting for: Arco, Ermor"]
+
+@pytest.mark.asyncio
+async def test_stopping_a_game_clears_its_reminders(host):
+  game = host.create_new_game("stopped", port = 21600)
+  host.reminders.update_deadline(game, 2 * 86400)
+  assert host.reminders.deadlines
+  await game.stop()
+  assert host.reminders.deadlines == {}
+  assert not any(key[0] == "stopped" for key in host.scheduler.entries)
@@ -0,0 +1,53 @@
+from heavenly.host import Host
+from heavenly.state import StateStore, StatePublisher, StoreView
+
+def mirror(host):
+  library = Host(host.root, port_range = host.port_range, mirror = True)
+  return StoreView(StateStore(host.root / "state.sqlite3"), library)
+
+def test_refresh_picks_up_changes_outside_the_summary(host):
+  publisher = StatePublisher(host, StateStore(host.root / "state.sqlite3"))
+  game = host.create_new_game("mirrored", port = 21600)
+  game.publish_status()
+  publisher.flush()
+  view = mirror(host)
+  view.refresh()
+  assert view.find_game_by_name("mirrored").connections is None
+
+  # connections aren't part of the summary, so the host version stays put
+  version = host.version
+  game.__dict__["connections"] = 2
+  game.publish_status()
+  publisher.flush()
+  assert host.version == version
+  view.refresh()
+  assert view.find_game_by_name("mirrored").connections == 2
+
+def test_refresh_drops_deleted_games(host):
+  publisher = StatePublisher(host, StateStore(host.root / "state.sqlite3"))
+  game = host.create_new_game("gone", port = 21600)
+  publisher.flush()
+  view = mirror(host)
+  view.refresh()
+  assert view.find_game_by_name("gone")
+
+  host.games.remove(game)
+  publisher.on_game_change(game)
+  publisher.flush()
+  view.refresh()
+  assert view.find_game_by_name("gone") is None
+
+def test_refresh_rereads_games_after_a_supervisor_restart(host):
+  store = StateStore(host.root / "state.sqlite3")
+  publisher = StatePublisher(host, store)
+  host.create_new_game("restarted", port = 21600)
+  publisher.flush()
+  view = mirror(host)
+  view.refresh()
+
+  # a new supervisor counts versions from scratch and may repeat one
+  status = dict(host.find_game_by_name("restarted").status(), state = "changed")
+  store.write_games([("restarted", view.find_game_by_name("restarted").version, status)])
+  store.write_meta(epoch = host.epoch + 1, version = 0)
+  view.refresh()
+  assert view.find_game_by_name("restarted").state == "changed"